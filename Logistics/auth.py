@@ -1,4 +1,7 @@
 import jwt
+import threading
+import time
+from collections import OrderedDict
 from django.conf import settings
 from datetime import datetime, timedelta
 from django.contrib.auth import authenticate
@@ -6,6 +9,40 @@ from django.http import JsonResponse
 import json
 
 
+class TokenCache:
+    # Thread-safe LRU of verified tokens -> user_id; an entry is dropped once the token's exp has passed
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._tokens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._tokens.get(token)
+            if entry is None:
+                return None
+            user_id, expires_at = entry
+            if expires_at <= time.time():
+                del self._tokens[token]
+                return None
+            self._tokens.move_to_end(token)
+            return user_id
+
+    def set(self, token, user_id, expires_at):
+        with self._lock:
+            self._tokens[token] = (user_id, expires_at)
+            self._tokens.move_to_end(token)
+            while len(self._tokens) > self.max_size:
+                self._tokens.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._tokens.clear()
+
+
+token_cache = TokenCache(settings.JWT_TOKEN_CACHE_SIZE)
+
+
 def generate_jwt_token(user_id):
     payload = {
         'user_id': user_id,
@@ -15,15 +52,37 @@ def generate_jwt_token(user_id):
 
 
 def decode_jwt_token(token):
+    token = token.replace("Bearer ","")
+    user_id = token_cache.get(token)
+    if user_id is not None:
+        return user_id
     try:
-        payload = jwt.decode(token.replace("Bearer ",""), settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
-        return payload['user_id']
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         # Handle token expiration
         return None
     except jwt.InvalidTokenError:
         # Handle invalid token
         return None
+    if 'exp' in payload:
+        # Tokens without an expiry are verified every time
+        token_cache.set(token, payload['user_id'], payload['exp'])
+    return payload['user_id']
+
+
+def authenticate_request(request):
+    # Verifies the Authorization header once per request and keeps the outcome on it:
+    # user_id (None when unauthenticated) and auth_error explaining why
+    if request is None:
+        return None
+    if not hasattr(request, 'user_id'):
+        token = request.META.get('HTTP_AUTHORIZATION')
+        request.user_id = decode_jwt_token(token) if token else None
+        if request.user_id is not None:
+            request.auth_error = None
+        else:
+            request.auth_error = 'Invalid or expired token' if token else 'Token is missing'
+    return request.user_id
 
 
 def login(request):
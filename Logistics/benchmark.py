@@ -0,0 +1,281 @@
+import itertools
+import json
+import math
+import random
+import time
+import urllib.request
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.test import RequestFactory, override_settings
+from django.test.testcases import LiveServerThread
+from graphene.test import Client
+from . import bulk, caching, rollups, scheduling
+from .instrumentation import count_queries
+from .models import Vehicle, DeliveryJob
+from .schema import schema
+
+
+MAKES = ('Volvo', 'Scania', 'MAN', 'DAF', 'Iveco', 'Mercedes')
+DESTINATIONS = ('Depot', 'Harbour', 'Airport', 'Warehouse', 'Station', 'Market', 'Factory', 'Mall')
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+class Fixture:
+    # Ids of the seeded rows, sampled by scenarios that need arguments
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.vehicle_ids = list(Vehicle.objects.order_by('id').values_list('id', flat=True))
+        self.job_ids = list(DeliveryJob.objects.order_by('id').values_list('id', flat=True))
+        # New jobs get consecutive hours after the seeded year, so created bookings never conflict
+        self.slots = (datetime(2030, 1, 1, tzinfo=dt_timezone.utc) + timedelta(hours=hour) for hour in itertools.count())
+
+    def vehicle_id(self):
+        return self.rng.choice(self.vehicle_ids)
+
+    def job_id(self):
+        return self.rng.choice(self.job_ids)
+
+    def assignment(self):
+        # A job and a vehicle that is free for its slot
+        job = DeliveryJob.objects.only('delivery_slot', 'slot_end').get(pk=self.job_id())
+        free = scheduling.available_vehicles(Vehicle.objects.order_by('id'), job.delivery_slot, job.slot_end)
+        return {'jobId': job.id, 'vehicleId': self.rng.choice(list(free.values_list('id', flat=True)))}
+
+    def job_input(self):
+        return {
+            'destinationLocation': self.rng.choice(DESTINATIONS),
+            'deliverySlot': next(self.slots).isoformat(),
+            'income': '120.00',
+            'costs': '45.50',
+            'vehicleId': self.vehicle_id(),
+        }
+
+
+# (name, document, variables factory); one scenario per Query root field and per mutation
+SCENARIOS = [
+    ('Query.totalCount', '{ totalCount }', None),
+    (
+        'Query.calculateMonthlyIncomeCosts',
+        '{ calculateMonthlyIncomeCosts(month: 6, year: 2023) { totalIncome totalCosts jobCount } }',
+        None,
+    ),
+    (
+        'Query.calculateYearlyIncomeCosts',
+        '{ calculateYearlyIncomeCosts(year: 2023) { month totalIncome totalCosts } }',
+        None,
+    ),
+    (
+        'Query.allVehicles',
+        '{ allVehicles(page: 1, pageSize: 5) { id make model deliveryJobs { id profit } } }',
+        None,
+    ),
+    (
+        'Query.vehicleAvailability',
+        '{ vehicleAvailability(from: "2023-06-01T09:00:00+00:00", to: "2023-06-01T17:00:00+00:00", numRows: 20) { id make } }',
+        None,
+    ),
+    (
+        'Query.vehicleProfitability',
+        '{ vehicleProfitability(from: "2023-06-01T00:00:00+00:00", to: "2023-07-01T00:00:00+00:00", top: 10)'
+        ' { totalProfit jobCount vehicle { make } } }',
+        None,
+    ),
+    (
+        'Query.allDeliveryJobs',
+        '{ allDeliveryJobs(page: 1, pageSize: 100, completed: false) { id destinationLocation profit vehicle { make } } }',
+        None,
+    ),
+    (
+        'Query.allDeliveryJobsConnection',
+        '{ allDeliveryJobsConnection(first: 100, orderByMostProfitableVehicle: true)'
+        ' { edges { cursor node { id profit } } pageInfo { hasNextPage } } }',
+        None,
+    ),
+    (
+        'Query.allVehiclesConnection',
+        '{ allVehiclesConnection(first: 100, isActive: true)'
+        ' { edges { cursor node { id make deliveryJobs { id profit } } } pageInfo { hasNextPage } } }',
+        None,
+    ),
+    (
+        'Mutation.createVehicle',
+        'mutation { createVehicle(make: "Volvo", model: "FH16", year: 2023) { vehicle { id } } }',
+        None,
+    ),
+    (
+        'Mutation.createDeliveryJob',
+        'mutation($destinationLocation: String, $deliverySlot: DateTime, $income: Decimal, $costs: Decimal, $vehicleId: ID) {'
+        ' createDeliveryJob(destinationLocation: $destinationLocation, deliverySlot: $deliverySlot, income: $income,'
+        ' costs: $costs, vehicleId: $vehicleId) { deliveryJob { id } } }',
+        lambda fixture: fixture.job_input(),
+    ),
+    (
+        'Mutation.assignVehicleToJob',
+        'mutation($jobId: ID!, $vehicleId: ID!) { assignVehicleToJob(jobId: $jobId, vehicleId: $vehicleId) { deliveryJob { id } } }',
+        lambda fixture: fixture.assignment(),
+    ),
+    (
+        'Mutation.markDeliveryJobsAsCompleted',
+        'mutation($jobIds: [Int]!) { markDeliveryJobsAsCompleted(jobIds: $jobIds) { success } }',
+        lambda fixture: {'jobIds': [fixture.job_id() for _ in range(10)]},
+    ),
+    (
+        'Mutation.bulkCreateVehicles',
+        'mutation($vehicles: [VehicleInput!]!) { bulkCreateVehicles(vehicles: $vehicles) { vehicles { id } } }',
+        lambda fixture: {'vehicles': [{'make': 'DAF', 'model': 'XF', 'year': 2022}] * 50},
+    ),
+    (
+        'Mutation.bulkCreateDeliveryJobs',
+        'mutation($jobs: [DeliveryJobInput!]!) { bulkCreateDeliveryJobs(deliveryJobs: $jobs) { deliveryJobs { id } } }',
+        lambda fixture: {'jobs': [fixture.job_input() for _ in range(50)]},
+    ),
+    (
+        'Mutation.autoDispatch',
+        'mutation { autoDispatch(from: "2023-06-01T00:00:00+00:00", to: "2023-06-02T00:00:00+00:00") { assignedCount } }',
+        None,
+    ),
+]
+
+
+def seed(jobs, vehicles, batch_size=5000, seed=0):
+    # Deterministic fleet and a year of delivery jobs, written in bulk, with rollups rebuilt at the end
+    rng = random.Random(seed)
+    Vehicle.objects.bulk_create(
+        (
+            Vehicle(make=MAKES[i % len(MAKES)], model=f'Model {i % 20}', year=2010 + i % 15, is_active=i % 10 != 0)
+            for i in range(vehicles)
+        ),
+        batch_size=batch_size,
+    )
+    vehicle_ids = list(Vehicle.objects.values_list('id', flat=True))
+    start = datetime(2023, 1, 1, tzinfo=dt_timezone.utc)
+    for chunk in bulk.chunked(range(jobs), batch_size):
+        rows = []
+        for _ in chunk:
+            slot = start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+            income = Decimal(rng.randrange(5000, 50000)) / 100
+            rows.append(DeliveryJob(
+                destination_location=rng.choice(DESTINATIONS),
+                delivery_slot=slot,
+                income=income,
+                costs=(income * Decimal(rng.randrange(20, 90)) / 100).quantize(Decimal('0.01')),
+                vehicle_id=rng.choice(vehicle_ids) if vehicle_ids and rng.random() < 0.9 else None,
+                completed_at=slot + timedelta(hours=2) if rng.random() < 0.7 else None,
+            ))
+        DeliveryJob.objects.bulk_create(rows, batch_size=batch_size)
+    rollups.rebuild()
+    caching.invalidate('vehicles', 'delivery_jobs')
+
+
+def percentile(values, fraction):
+    # Nearest-rank percentile
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def summarize(latencies, elapsed, query_counts=None):
+    return {
+        'iterations': len(latencies),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'queries': max(query_counts) if query_counts else None,
+    }
+
+
+def _check(name, response):
+    if response.get('errors'):
+        raise BenchmarkError(f"{name} failed: {response['errors'][0].get('message')}")
+
+
+def _run(name, document, variables, fixture, call, iterations, warmup, keep_caches):
+    latencies, query_counts = [], []
+    started = time.perf_counter()
+    for iteration in range(warmup + iterations):
+        if not keep_caches:
+            cache.clear()
+        values = variables(fixture) if variables else None
+        with count_queries() as counter:
+            start = time.perf_counter()
+            response = call(document, values)
+            latency = time.perf_counter() - start
+        _check(name, response)
+        if iteration == warmup - 1:
+            started = time.perf_counter()
+        if iteration >= warmup:
+            latencies.append(latency)
+            query_counts.append(counter.count)
+    return latencies, time.perf_counter() - started, query_counts
+
+
+def run_inprocess(fixture, iterations, warmup=5, keep_caches=False, scenarios=SCENARIOS):
+    # Straight through graphene with a fresh request context per call, so loaders start empty
+    client = Client(schema)
+    factory = RequestFactory()
+
+    def call(document, variables):
+        return client.execute(document, variables=variables, context_value=factory.post('/graphql/'))
+
+    results = {}
+    for name, document, variables in scenarios:
+        latencies, elapsed, query_counts = _run(name, document, variables, fixture, call, iterations, warmup, keep_caches)
+        results[name] = summarize(latencies, elapsed, query_counts)
+    return results
+
+
+def run_http(fixture, iterations, warmup=5, keep_caches=False, scenarios=SCENARIOS, path='/graphql/'):
+    # Through the full view stack on a live server thread. SQL counts are only visible when the
+    # server shares this thread's connection (in-memory SQLite), so they are reported in-process only.
+    overrides = {}
+    for conn in connections.all():
+        if conn.vendor == 'sqlite' and conn.is_in_memory_db():
+            conn.inc_thread_sharing()
+            overrides[conn.alias] = conn
+    server = LiveServerThread('localhost', static_handler=lambda handler: handler, connections_override=overrides)
+    server.daemon = True
+    server.start()
+    server.is_ready.wait()
+    if server.error:
+        raise server.error
+    url = f'http://{server.host}:{server.port}{path}'
+
+    def call(document, variables):
+        body = json.dumps({'query': document, 'variables': variables}).encode()
+        request = urllib.request.Request(url, data=body, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    results = {}
+    try:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, server.host]):
+            for name, document, variables in scenarios:
+                latencies, elapsed, _ = _run(name, document, variables, fixture, call, iterations, warmup, keep_caches)
+                results[name] = summarize(latencies, elapsed)
+    finally:
+        server.terminate()
+        for conn in overrides.values():
+            conn.dec_thread_sharing()
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    # Lists regressions against a stored run: latency beyond the tolerance or any extra SQL query
+    regressions = []
+    for mode, scenarios in results['results'].items():
+        for name, current in scenarios.items():
+            previous = baseline.get('results', {}).get(mode, {}).get(name)
+            if previous is None:
+                continue
+            for metric in ('p50_ms', 'p99_ms'):
+                if current[metric] > previous[metric] * (1 + tolerance):
+                    regressions.append(f"{mode} {name}: {metric} {previous[metric]} -> {current[metric]}")
+            if current['queries'] is not None and previous.get('queries') is not None and current['queries'] > previous['queries']:
+                regressions.append(f"{mode} {name}: SQL queries {previous['queries']} -> {current['queries']}")
+    return regressions
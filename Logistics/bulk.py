@@ -0,0 +1,62 @@
+from itertools import islice
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from .models import Vehicle, DeliveryJob
+from . import rollups, scheduling
+
+
+def default_batch_size():
+    return settings.LOGISTICS_BULK_BATCH_SIZE
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def validation_message(error):
+    if hasattr(error, 'message_dict'):
+        return "; ".join(f"{field}: {' '.join(messages)}" for field, messages in error.message_dict.items())
+    return " ".join(error.messages)
+
+
+def validate_instance(instance, exclude=()):
+    # Field-level validation only; relations are checked in bulk by the caller
+    try:
+        instance.clean_fields(exclude=exclude)
+    except ValidationError as e:
+        return validation_message(e)
+    return None
+
+
+def existing_vehicles(vehicle_ids):
+    # One id__in lookup for every vehicle referenced by a batch
+    return Vehicle.objects.in_bulk({vehicle_id for vehicle_id in vehicle_ids if vehicle_id is not None})
+
+
+def create_vehicles(vehicles, batch_size):
+    created = []
+    for chunk in chunked(vehicles, batch_size):
+        created.extend(Vehicle.objects.bulk_create(chunk))
+    return created
+
+
+def create_delivery_jobs(jobs, batch_size):
+    # Caller owns the transaction; the financial rollup is updated once for the whole batch.
+    # Jobs that would double-book a vehicle are not written: returns (created, [(position, message)]).
+    # Earlier chunks are already inserted when a later one is checked, so they count as bookings.
+    created, rejected = [], []
+    for number, chunk in enumerate(chunked(jobs, batch_size)):
+        conflicts = scheduling.batch_conflicts(chunk)
+        rejected.extend((number * batch_size + position, message) for position, message in sorted(conflicts.items()))
+        created.extend(DeliveryJob.objects.bulk_create([job for position, job in enumerate(chunk) if position not in conflicts]))
+    rollups.record_created(created)
+    return created, rejected
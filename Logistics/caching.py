@@ -0,0 +1,50 @@
+import hashlib
+import json
+import time
+from django.core.cache import cache
+
+
+def _generation_key(tag):
+    return f'logistics:generation:{tag}'
+
+
+def generation(tag):
+    # Seeded from the clock so an evicted generation never reuses an old value
+    key = _generation_key(tag)
+    value = cache.get(key)
+    if value is None:
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def invalidate(*tags):
+    # Bumping a tag's generation orphans every entry keyed under the old one
+    for tag in tags:
+        try:
+            cache.incr(_generation_key(tag))
+        except ValueError:
+            cache.set(_generation_key(tag), time.time_ns(), None)
+
+
+async def ageneration(tag):
+    key = _generation_key(tag)
+    value = await cache.aget(key)
+    if value is None:
+        await cache.aadd(key, time.time_ns(), None)
+        value = await cache.aget(key)
+    return value
+
+
+def _digest(payload):
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def make_key(prefix, tags, payload):
+    generations = '.'.join(str(generation(tag)) for tag in tags)
+    return f'logistics:{prefix}:{generations}:{_digest(payload)}'
+
+
+async def amake_key(prefix, tags, payload):
+    generations = '.'.join([str(await ageneration(tag)) for tag in tags])
+    return f'logistics:{prefix}:{generations}:{_digest(payload)}'
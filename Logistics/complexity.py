@@ -0,0 +1,120 @@
+from django.conf import settings
+from graphene.validation import depth_limit_validator
+from graphql import GraphQLError, ValidationRule, get_named_type, get_nullable_type, is_list_type, specified_rules
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode, IntValueNode, NonNullTypeNode, VariableNode
+
+
+# Extra weight for root fields that do more than a plain lookup; any other object field costs 1, scalars 0
+FIELD_COSTS = {
+    'Query.totalCount': 5,
+    'Query.calculateYearlyIncomeCosts': 5,
+}
+
+# Arguments that bound how many items a list (or a connection's edges) returns. Page sizes only
+# apply when a page is requested; without one the list resolvers return up to the cap.
+SIZE_ARGUMENTS = ('first', 'top', 'num_rows', 'numRows')
+PAGE_SIZE_ARGUMENTS = ('page_size', 'pageSize')
+PAGE_ARGUMENT = 'page'
+DEFAULT_PAGE_SIZE = 10
+
+
+def max_list_size():
+    return settings.LOGISTICS_MAX_LIST_SIZE
+
+
+def is_paginated(page, required_variables):
+    # The resolvers paginate on any non-zero page; a variable only counts when it is declared non-null
+    if isinstance(page, IntValueNode):
+        return int(page.value) != 0
+    return isinstance(page, VariableNode) and page.name.value in required_variables
+
+
+def size_argument(node, required_variables=frozenset()):
+    # Returns the size a list is charged at, or None when no argument bounds it. Variables are
+    # charged at the cap because validated documents are cached independently of variables, and so
+    # are literals below 1, which the resolvers reject.
+    arguments = {argument.name.value: argument.value for argument in node.arguments}
+    if is_paginated(arguments.get(PAGE_ARGUMENT), required_variables):
+        for name in PAGE_SIZE_ARGUMENTS:
+            value = arguments.get(name)
+            if value is None:
+                continue
+            if not isinstance(value, IntValueNode):
+                return max_list_size()
+            # The resolvers clamp pages to the cap, like the other sizes
+            size = int(value.value)
+            return min(size, max_list_size()) if size >= 1 else DEFAULT_PAGE_SIZE if size == 0 else max_list_size()
+        return DEFAULT_PAGE_SIZE
+    for name in SIZE_ARGUMENTS:
+        value = arguments.get(name)
+        if value is not None:
+            if isinstance(value, IntValueNode) and int(value.value) >= 1:
+                return min(int(value.value), max_list_size())
+            return max_list_size()
+    return None
+
+
+class QueryCostRule(ValidationRule):
+    # Rejects operations whose estimated row/field count exceeds LOGISTICS_QUERY_MAX_COST before execution
+    def enter_operation_definition(self, node, *_):
+        root_type = self.context.schema.get_root_type(node.operation)
+        if root_type is None:
+            return
+        self.required_variables = {
+            definition.variable.name.value
+            for definition in node.variable_definitions or ()
+            if isinstance(definition.type, NonNullTypeNode)
+        }
+        cost = self.selection_cost(node.selection_set, root_type, 1, None, set())
+        if cost > settings.LOGISTICS_QUERY_MAX_COST:
+            self.report_error(
+                GraphQLError(
+                    f"Query cost {cost} exceeds the maximum of {settings.LOGISTICS_QUERY_MAX_COST}."
+                    " Request fewer rows with page/pageSize/numRows/first or select fewer nested lists.",
+                    node,
+                )
+            )
+
+    def selection_cost(self, selection_set, parent_type, multiplier, inherited_size, fragments):
+        cost = 0
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                cost += self.field_cost(selection, parent_type, multiplier, inherited_size, fragments)
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition:
+                    fragment_type = self.context.schema.get_type(selection.type_condition.name.value) or parent_type
+                cost += self.selection_cost(selection.selection_set, fragment_type, multiplier, inherited_size, fragments)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.context.get_fragment(name)
+                if fragment is None or name in fragments:
+                    continue
+                fragment_type = self.context.schema.get_type(fragment.type_condition.name.value) or parent_type
+                cost += self.selection_cost(fragment.selection_set, fragment_type, multiplier, inherited_size, fragments | {name})
+        return cost
+
+    def field_cost(self, node, parent_type, multiplier, inherited_size, fragments):
+        fields = getattr(parent_type, 'fields', None) or {}
+        field = fields.get(node.name.value)
+        if field is None:
+            return 0
+        configured = FIELD_COSTS.get(f'{parent_type.name}.{node.name.value}')
+        if node.selection_set is None:
+            return (configured or 0) * multiplier
+        weight = 1 if configured is None else configured
+        size = size_argument(node, self.required_variables)
+        child_size = None
+        if is_list_type(get_nullable_type(field.type)):
+            # Unbounded lists are charged at the hard cap the resolvers enforce
+            multiplier *= size or inherited_size or max_list_size()
+        elif size is not None:
+            # A connection's first applies to its edges list
+            child_size = size
+        return weight * multiplier + self.selection_cost(
+            node.selection_set, get_named_type(field.type), multiplier, child_size, fragments
+        )
+
+
+def default_validation_rules():
+    return (*specified_rules, QueryCostRule, depth_limit_validator(max_depth=settings.LOGISTICS_QUERY_MAX_DEPTH))
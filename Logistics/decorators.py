@@ -1,18 +1,14 @@
-from Logistics.auth import decode_jwt_token
+from Logistics.auth import authenticate_request
 from functools import wraps
-from django.http import JsonResponse
+from graphql import GraphQLError
 
 def jwt_auth_required(view_func):
     @wraps(view_func)
     def wrapped_view(root, info, *args, **kwargs):
+        # The token was verified once for the whole request (see authenticate_request)
         request = info.context
-        token = request.META.get('HTTP_AUTHORIZATION')
-        if not token:
-            return JsonResponse({'error': 'Token is missing'}, status=403)
-
-        user_id = decode_jwt_token(token)
-        if user_id is None:
-            return JsonResponse({'error': 'Invalid or expired token'}, status=403)
-        setattr(request, 'user_id', user_id)
+        if authenticate_request(request) is None:
+            message = getattr(request, 'auth_error', None) or 'Token is missing'
+            raise GraphQLError(message, extensions={'code': 'UNAUTHENTICATED'})
         return view_func(root, info, *args, **kwargs)
-    return wrapped_view
\ No newline at end of file
+    return wrapped_view
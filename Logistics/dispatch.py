@@ -0,0 +1,159 @@
+import heapq
+from bisect import bisect_left, insort
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from django.db import transaction
+from . import bulk, caching, rollups, scheduling
+from .models import DeliveryJob, Vehicle, default_slot_end
+from .planner import apply_filters
+
+
+EARLIEST = datetime.min.replace(tzinfo=dt_timezone.utc)
+NEVER = datetime.max.replace(tzinfo=dt_timezone.utc)
+
+
+class LoadTree:
+    # Range add / range max over the elementary segments between sorted time points:
+    # peak(lo, hi) is the most slots running at once anywhere in [points[lo], points[hi])
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self.top = [0] * (4 * self.size)    # highest load inside the node
+        self.whole = [0] * (4 * self.size)  # load added to the node's entire range
+
+    def add(self, lo, hi, value, node=1, left=0, right=None):
+        right = self.size if right is None else right
+        if hi <= left or right <= lo:
+            return
+        if lo <= left and right <= hi:
+            self.top[node] += value
+            self.whole[node] += value
+            return
+        middle = (left + right) // 2
+        self.add(lo, hi, value, 2 * node, left, middle)
+        self.add(lo, hi, value, 2 * node + 1, middle, right)
+        self.top[node] = self.whole[node] + max(self.top[2 * node], self.top[2 * node + 1])
+
+    def peak(self, lo, hi, node=1, left=0, right=None):
+        right = self.size if right is None else right
+        if hi <= left or right <= lo:
+            return 0
+        if lo <= left and right <= hi:
+            return self.top[node]
+        middle = (left + right) // 2
+        return self.whole[node] + max(
+            self.peak(lo, hi, 2 * node, left, middle),
+            self.peak(lo, hi, 2 * node + 1, middle, right),
+        )
+
+
+def admit(jobs, capacity, bookings):
+    # Most profitable first, a job is kept while no more than `capacity` slots (existing bookings
+    # included) would run at once during it. For interchangeable vehicles that is exactly the
+    # condition under which the kept jobs can all be given a vehicle.
+    fixed = [interval for intervals in bookings.values() for interval in intervals]
+    points = sorted({time for interval in fixed for time in interval} | {time for _, start, end, _ in jobs for time in (start, end)})
+    index = {time: position for position, time in enumerate(points)}
+    load = LoadTree(len(points) - 1)
+    for start, end in fixed:
+        load.add(index[start], index[end], 1)
+    admitted = []
+    for job in sorted(jobs, key=lambda job: (-job[3], job[1], job[0])):
+        lo, hi = index[job[1]], index[job[2]]
+        if load.peak(lo, hi) < capacity:
+            load.add(lo, hi, 1)
+            admitted.append(job)
+    return admitted
+
+
+def partition(jobs, vehicle_ids, bookings):
+    # Interval partitioning in start order. Free vehicles are kept sorted by the start of their next
+    # existing booking and a job takes the one whose next booking is the soonest it still ends before.
+    # Busy vehicles wait in a heap until their slot ends.
+    booking_starts = {vehicle_id: [start for start, _ in bookings.get(vehicle_id, ())] for vehicle_id in vehicle_ids}
+
+    def next_booking(vehicle_id, time):
+        starts = booking_starts[vehicle_id]
+        position = bisect_left(starts, time)
+        return starts[position] if position < len(starts) else NEVER
+
+    free = sorted((next_booking(vehicle_id, EARLIEST), vehicle_id) for vehicle_id in vehicle_ids)
+    events = sorted((start, end, vehicle_id) for vehicle_id in vehicle_ids for start, end in bookings.get(vehicle_id, ()))
+    running, assignments, position = [], {}, 0
+    for job_id, start, end, _ in sorted(jobs, key=lambda job: (job[1], job[2], job[0])):
+        # Replay releases and existing bookings up to this start; a release at t comes before a booking at t
+        while True:
+            booked = events[position][0] if position < len(events) else NEVER
+            if running and running[0][0] <= min(start, booked):
+                released, vehicle_id = heapq.heappop(running)
+                insort(free, (next_booking(vehicle_id, released), vehicle_id))
+            elif booked <= start:
+                _, until, vehicle_id = events[position]
+                position += 1
+                del free[bisect_left(free, (booked, vehicle_id))]
+                heapq.heappush(running, (until, vehicle_id))
+            else:
+                break
+        slot = bisect_left(free, (end,))
+        if slot == len(free):
+            continue
+        _, vehicle_id = free.pop(slot)
+        assignments[job_id] = vehicle_id
+        heapq.heappush(running, (end, vehicle_id))
+    return assignments
+
+
+def solve(jobs, vehicle_ids, bookings):
+    # jobs are (id, start, end, profit); bookings maps a vehicle id to its merged, sorted
+    # (start, end) intervals. Returns {job id: vehicle id} for the jobs that were placed.
+    return partition(admit(jobs, len(vehicle_ids), bookings), vehicle_ids, bookings)
+
+
+def load_bookings(vehicle_ids, start, horizon):
+    # Slots already booked on the active vehicles around [start, horizon), merged per vehicle
+    rows = apply_filters(DeliveryJob.objects.filter(vehicle__isnull=False), scheduling.overlap_lookups(start, horizon))
+    bookings = {}
+    for vehicle_id, slot, slot_end in rows.order_by('delivery_slot').values_list('vehicle_id', 'delivery_slot', 'slot_end').iterator():
+        if vehicle_id not in vehicle_ids:
+            continue
+        slot_end = slot_end or default_slot_end(slot)
+        intervals = bookings.setdefault(vehicle_id, [])
+        if intervals and slot <= intervals[-1][1]:
+            intervals[-1] = (intervals[-1][0], max(intervals[-1][1], slot_end))
+        else:
+            intervals.append((slot, slot_end))
+    return bookings
+
+
+class DispatchResult:
+    def __init__(self, assignments, unassigned_job_ids, profit):
+        self.assignments = assignments
+        self.unassigned_job_ids = unassigned_job_ids
+        self.profit = profit
+
+
+def dispatch(start, end, batch_size=None):
+    # Assigns the open, unassigned jobs whose slot starts in [start, end) to active vehicles.
+    # Three reads and one bulk_update, whatever the number of jobs; the vehicle rows are locked
+    # like single bookings lock them, so the two cannot interleave.
+    start, end = scheduling.check_window(start, end)
+    with transaction.atomic():
+        vehicle_ids = set(Vehicle.objects.select_for_update().filter(is_active=True).values_list('id', flat=True))
+        rows = apply_filters(
+            DeliveryJob.objects.select_for_update(),
+            {'vehicle_id__isnull': True, 'delivery_slot__gte': start, 'delivery_slot__lt': end, 'completed_at__isnull': True},
+        ).order_by('id').values_list('id', 'delivery_slot', 'slot_end', 'income', 'costs')
+        details = {job_id: (slot, slot_end or default_slot_end(slot), income, costs) for job_id, slot, slot_end, income, costs in rows}
+        jobs = [(job_id, slot, slot_end, income - costs) for job_id, (slot, slot_end, income, costs) in details.items()]
+        horizon = max((job[2] for job in jobs), default=end)
+        assignments = solve(jobs, sorted(vehicle_ids), load_bookings(vehicle_ids, start, horizon)) if vehicle_ids else {}
+
+        updated = [
+            DeliveryJob(id=job_id, delivery_slot=details[job_id][0], income=details[job_id][2], costs=details[job_id][3], vehicle_id=vehicle_id)
+            for job_id, vehicle_id in assignments.items()
+        ]
+        DeliveryJob.objects.bulk_update(updated, ['vehicle'], batch_size=batch_size or bulk.default_batch_size())
+        rollups.record_reassigned(updated, {})
+    if updated:
+        caching.invalidate('delivery_jobs')
+    profit = sum((job[3] for job in jobs if job[0] in assignments), Decimal(0))
+    return DispatchResult(assignments, [job[0] for job in jobs if job[0] not in assignments], profit)
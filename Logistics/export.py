@@ -0,0 +1,103 @@
+import csv
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
+from .schema import filter_delivery_jobs
+
+
+COLUMNS = ("id", "created_at", "completed_at", "destination_location", "delivery_slot", "slot_end", "income", "costs", "profit", "vehicle_id")
+
+def parse_decimal(value):
+    # Decimal() also accepts NaN and Infinity, which the ORM then rejects with a ValidationError
+    number = Decimal(value)
+    if not number.is_finite():
+        raise ValueError(value)
+    return number
+
+
+def parse_bool(value):
+    value = value.lower()
+    if value in ("1", "true", "yes"):
+        return True
+    if value in ("0", "false", "no"):
+        return False
+    raise ValueError(value)
+
+
+# Query string parameters accepted by the export, mirroring the allDeliveryJobs filter arguments.
+# List filters are comma-separated.
+PARSERS = {
+    "destination_location": str,
+    "delivery_slot": parse_datetime,
+    "income": parse_decimal,
+    "costs": parse_decimal,
+    "vehicle_id": int,
+    "min_profit": parse_decimal,
+    "max_profit": parse_decimal,
+    "delivery_slot_from": parse_datetime,
+    "delivery_slot_to": parse_datetime,
+    "min_income": parse_decimal,
+    "max_costs": parse_decimal,
+    "vehicle_ids": lambda value: [int(vehicle_id) for vehicle_id in value.split(",")],
+    "destinations": lambda value: value.split(","),
+    "completed": parse_bool,
+    "orderByMostProfitableVehicle": parse_bool,
+}
+
+
+class Echo:
+    # File-like object for csv.writer that hands each row straight back to the response
+    def write(self, value):
+        return value
+
+
+def csv_rows(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(COLUMNS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_rows(rows):
+    encoder = DjangoJSONEncoder()
+    for row in rows:
+        yield encoder.encode(dict(zip(COLUMNS, row))) + "\n"
+
+
+def parse_filters(params):
+    filters = {}
+    for name, parse in PARSERS.items():
+        value = params.get(name)
+        if value in (None, ""):
+            continue
+        try:
+            filters[name] = parse(value)
+        except (InvalidOperation, ValueError):
+            raise ValueError(f"Invalid value for {name}")
+        if filters[name] is None:
+            raise ValueError(f"Invalid value for {name}")
+    return filters
+
+
+def export_delivery_jobs(request):
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Only GET requests are allowed'}, status=405)
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return JsonResponse({'error': 'format must be csv or ndjson'}, status=400)
+    try:
+        filters = parse_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    queryset, _ = filter_delivery_jobs(**filters)
+    # values_list + iterator keeps memory flat: rows are fetched and written chunk by chunk
+    rows = queryset.values_list(*COLUMNS).iterator(chunk_size=settings.LOGISTICS_EXPORT_CHUNK_SIZE)
+    if export_format == 'csv':
+        response = StreamingHttpResponse(csv_rows(rows), content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="delivery_jobs.csv"'
+    else:
+        response = StreamingHttpResponse(ndjson_rows(rows), content_type='application/x-ndjson')
+    return response
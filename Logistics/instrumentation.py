@@ -0,0 +1,204 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from inspect import isawaitable
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.http import HttpResponse
+from django.utils.module_loading import import_string
+
+
+class QueryCounter:
+    # Execute wrapper that tallies the SQL statements run on a connection
+    def __init__(self, capture=False):
+        self.count = 0
+        self.duration = 0.0
+        self.capture = capture
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add(sql, time.perf_counter() - start)
+
+    def add(self, sql, duration):
+        self.count += 1
+        self.duration += duration
+        if self.capture:
+            self.queries.append(sql)
+
+
+@contextmanager
+def count_queries(using=DEFAULT_DB_ALIAS, capture=False):
+    counter = QueryCounter(capture=capture)
+    with connections[using].execute_wrapper(counter):
+        yield counter
+
+
+# Counters open in the current coroutine. The async ORM runs queries on a worker thread, but
+# sync_to_async carries the caller's context there, so each query is credited to the coroutine that issued it.
+_async_counters = ContextVar('logistics_async_counters', default=())
+
+
+def _count_async_query(execute, sql, params, many, context):
+    counters = _async_counters.get()
+    if not counters:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        for counter in counters:
+            counter.add(sql, time.perf_counter() - start)
+
+
+@sync_to_async
+def track_async_queries(using=DEFAULT_DB_ALIAS):
+    # Installs the context-aware wrapper on the async ORM thread's connection. It goes first in the list
+    # so execute_wrapper()'s pop() never removes it, and passes straight through when no counter is open.
+    wrappers = connections[using].execute_wrappers
+    if _count_async_query not in wrappers:
+        wrappers.insert(0, _count_async_query)
+
+
+@asynccontextmanager
+async def acount_queries(capture=False):
+    counter = QueryCounter(capture=capture)
+    token = _async_counters.set(_async_counters.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _async_counters.reset(token)
+
+
+class LogSink:
+    # Writes one line per resolver/operation to the Logistics.metrics logger
+    def __init__(self):
+        self.logger = logging.getLogger('Logistics.metrics')
+
+    def record(self, kind, name, duration, query_count, query_duration):
+        self.logger.info(
+            "%s %s %.2fms sql=%d sql_time=%.2fms", kind, name, duration * 1000, query_count, query_duration * 1000
+        )
+
+
+class HistogramSink:
+    # In-process Prometheus-style histograms, rendered by the metrics view
+    buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    overflow_name = 'other'
+
+    def __init__(self, max_series=None):
+        self._lock = threading.Lock()
+        self._series = {}
+        self._series_per_kind = Counter()
+        self.max_series = settings.LOGISTICS_METRICS_MAX_SERIES if max_series is None else max_series
+
+    def record(self, kind, name, duration, query_count, query_duration):
+        index = bisect.bisect_left(self.buckets, duration)
+        with self._lock:
+            series = self._series.get((kind, name))
+            if series is None and self._series_per_kind[kind] >= self.max_series:
+                # Keeps memory and /metrics/ label cardinality bounded however many names clients send
+                name = self.overflow_name
+                series = self._series.get((kind, name))
+            if series is None:
+                if name != self.overflow_name:
+                    self._series_per_kind[kind] += 1
+                series = self._series[(kind, name)] = {
+                    'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'queries': 0, 'query_time': 0.0,
+                }
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['count'] += 1
+            series['sum'] += duration
+            series['queries'] += query_count
+            series['query_time'] += query_duration
+
+    def render(self):
+        lines = [
+            '# TYPE logistics_graphql_duration_seconds histogram',
+            '# TYPE logistics_graphql_sql_queries_total counter',
+            '# TYPE logistics_graphql_sql_duration_seconds_total counter',
+        ]
+        with self._lock:
+            series = sorted(self._series.items())
+            for (kind, name), values in series:
+                labels = f'kind="{kind}",name="{name}"'
+                cumulative = 0
+                for bound, count in zip(self.buckets, values['buckets']):
+                    cumulative += count
+                    lines.append(f'logistics_graphql_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'logistics_graphql_duration_seconds_bucket{{{labels},le="+Inf"}} {values["count"]}')
+                lines.append(f'logistics_graphql_duration_seconds_sum{{{labels}}} {values["sum"]}')
+                lines.append(f'logistics_graphql_duration_seconds_count{{{labels}}} {values["count"]}')
+                lines.append(f'logistics_graphql_sql_queries_total{{{labels}}} {values["queries"]}')
+                lines.append(f'logistics_graphql_sql_duration_seconds_total{{{labels}}} {values["query_time"]}')
+        return '\n'.join(lines) + '\n'
+
+
+@functools.lru_cache(maxsize=None)
+def get_sinks():
+    return tuple(import_string(path)() for path in settings.LOGISTICS_METRICS_SINKS)
+
+
+def record(kind, name, duration, counter):
+    for sink in get_sinks():
+        sink.record(kind, name, duration, counter.count, counter.duration)
+
+
+@contextmanager
+def measure(kind, name):
+    start = time.perf_counter()
+    with count_queries() as counter:
+        try:
+            yield counter
+        finally:
+            record(kind, name, time.perf_counter() - start, counter)
+
+
+@asynccontextmanager
+async def ameasure(kind, name):
+    start = time.perf_counter()
+    async with acount_queries() as counter:
+        try:
+            yield counter
+        finally:
+            record(kind, name, time.perf_counter() - start, counter)
+
+
+class InstrumentationMiddleware:
+    # Graphene middleware timing root Query/Mutation fields; nested fields pass straight through.
+    # Async root resolvers are measured around the awaited coroutine rather than its creation.
+    def resolve(self, next, root, info, **args):
+        schema = info.schema
+        if info.parent_type is not schema.query_type and info.parent_type is not schema.mutation_type:
+            return next(root, info, **args)
+        name = f'{info.parent_type.name}.{info.field_name}'
+        start = time.perf_counter()
+        result = None
+        with count_queries() as counter:
+            try:
+                result = next(root, info, **args)
+                if isawaitable(result):
+                    return self.resolve_async(name, result)
+                return result
+            finally:
+                if not isawaitable(result):
+                    record('resolver', name, time.perf_counter() - start, counter)
+
+    async def resolve_async(self, name, result):
+        async with ameasure('resolver', name):
+            return await result
+
+
+def metrics(request):
+    body = ''.join(sink.render() for sink in get_sinks() if hasattr(sink, 'render'))
+    return HttpResponse(body, content_type='text/plain; version=0.0.4')
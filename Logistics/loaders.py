@@ -0,0 +1,180 @@
+import asyncio
+from collections import defaultdict
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Vehicle, DeliveryJob
+
+
+def in_event_loop():
+    # True when resolving on the async view's event loop, where the sync ORM would raise SynchronousOnlyOperation
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class BatchLoader:
+    # Collects keys and resolves all pending ones with a single query on the first load().
+    # On the event loop load() returns an awaitable instead: sibling resolvers queue their keys
+    # before any of them is awaited, so the first await fetches the whole batch.
+    default = None
+
+    def __init__(self):
+        self._cache = {}
+        self._pending = set()
+        self._batches = {}
+        self.query_count = 0
+
+    def queue(self, keys):
+        self._pending.update(key for key in keys if key is not None and key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache[key] = value
+        self._pending.discard(key)
+
+    def load(self, key):
+        if key is None:
+            return self.default
+        if key in self._cache:
+            return self._cache[key]
+        self._pending.add(key)
+        if in_event_loop():
+            return self._await_key(key)
+        self.dispatch()
+        return self._cache[key]
+
+    async def _await_key(self, key):
+        if key in self._pending:
+            keys, self._pending = self._pending, set()
+            batch = asyncio.ensure_future(self.adispatch(keys))
+            for pending_key in keys:
+                self._batches[pending_key] = batch
+        if key not in self._cache:
+            await self._batches[key]
+        return self._cache[key]
+
+    def dispatch(self):
+        keys, self._pending = self._pending, set()
+        if not keys:
+            return
+        results = self.fetch(keys)
+        self.query_count += 1
+        for key in keys:
+            self._cache[key] = results.get(key, self.default)
+
+    async def adispatch(self, keys):
+        try:
+            results = await self.afetch(keys)
+            self.query_count += 1
+            for key in keys:
+                self._cache[key] = results.get(key, self.default)
+        finally:
+            for key in keys:
+                self._batches.pop(key, None)
+
+    def fetch(self, keys):
+        raise NotImplementedError
+
+    async def afetch(self, keys):
+        raise NotImplementedError
+
+
+class ModelLoader(BatchLoader):
+    # pk -> instance
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self._narrowed = {}
+
+    def prime_narrowed(self, key, value):
+        # An instance loaded with only(). Its key is queued so that, if a selection needs more
+        # columns than it has, the full rows of every narrowed instance come back in one batch.
+        self._narrowed[key] = value
+        self.queue([key])
+
+    def load_fields(self, key, fields):
+        # Like load(), but serves a narrowed instance when it holds every field asked for; deferred
+        # fields would otherwise be loaded lazily one query per instance (and fail on the event loop)
+        narrowed = self._narrowed.get(key)
+        if key not in self._cache and narrowed is not None and not narrowed.get_deferred_fields() & set(fields):
+            return narrowed
+        return self.load(key)
+
+    def fetch(self, keys):
+        return self.model.objects.in_bulk(keys)
+
+    async def afetch(self, keys):
+        return await self.model.objects.ain_bulk(keys)
+
+
+class RelatedLoader(BatchLoader):
+    # foreign key value -> list of instances pointing at it, at most LOGISTICS_MAX_LIST_SIZE per key
+    def __init__(self, model, field):
+        super().__init__()
+        self.model = model
+        self.field = field
+
+    @property
+    def default(self):
+        return []
+
+    def queryset(self, keys):
+        # The per-key cap is applied in SQL with ROW_NUMBER() so a large parent never loads every row
+        position = Window(RowNumber(), partition_by=[F(self.field)], order_by=F('id').asc())
+        return (
+            self.model.objects.filter(**{f'{self.field}__in': keys})
+            .annotate(_position=position)
+            .filter(_position__lte=settings.LOGISTICS_MAX_LIST_SIZE)
+            .order_by('id')
+        )
+
+    def fetch(self, keys):
+        grouped = defaultdict(list)
+        for obj in self.queryset(keys):
+            grouped[getattr(obj, self.field)].append(obj)
+        return grouped
+
+    async def afetch(self, keys):
+        grouped = defaultdict(list)
+        async for obj in self.queryset(keys):
+            grouped[getattr(obj, self.field)].append(obj)
+        return grouped
+
+
+class Loaders:
+    def __init__(self):
+        self.vehicles = ModelLoader(Vehicle)
+        self.delivery_jobs_by_vehicle = RelatedLoader(DeliveryJob, 'vehicle_id')
+
+    @property
+    def query_count(self):
+        return sum(loader.query_count for loader in vars(self).values())
+
+
+class OperationRoot:
+    # Root value of an execution started without a request context; it carries that operation's loaders
+    pass
+
+
+def with_operation_root(args, kwargs):
+    # Execute kwargs for graphene's Schema.execute(): when neither a context nor a root value is
+    # given, a fresh OperationRoot holds the loaders so batching still spans the whole operation
+    given = lambda *names: any(kwargs.get(name) is not None for name in names)
+    if len(args) > 1 or given('context_value', 'context', 'root_value', 'root'):
+        return kwargs
+    return {**{k: v for k, v in kwargs.items() if k != 'root'}, 'root_value': OperationRoot()}
+
+
+def get_loaders(info):
+    # Loaders live on the request (or the operation's root value) so batching and caching are
+    # scoped to one GraphQL call. A fresh Loaders() per resolver would silently drop every batch.
+    holder = info.context if info.context is not None else info.root_value
+    if holder is None:
+        raise RuntimeError('Loaders need a context_value or root_value that lasts for the whole operation')
+    loaders = getattr(holder, '_loaders', None)
+    if loaders is None:
+        loaders = Loaders()
+        setattr(holder, '_loaders', loaders)
+    return loaders
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from graphql import GraphQLError
+from Logistics.dispatch import dispatch
+from Logistics.management.commands.import_delivery_jobs import check_batch_size, parse_timestamp
+
+
+class Command(BaseCommand):
+    help = "Assign the unassigned delivery jobs of a time window to free active vehicles, most profitable first"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="start", required=True, help="Window start (ISO 8601)")
+        parser.add_argument("--to", dest="end", required=True, help="Window end (ISO 8601), exclusive")
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        try:
+            start, end = parse_timestamp(options["start"]), parse_timestamp(options["end"])
+        except ValueError as e:
+            raise CommandError(e)
+        started = time.perf_counter()
+        try:
+            result = dispatch(start, end, check_batch_size(options["batch_size"]))
+        except GraphQLError as e:
+            raise CommandError(e.message)
+        self.stdout.write(self.style.SUCCESS(
+            f"Assigned {len(result.assignments)} jobs (profit {result.profit}), "
+            f"{len(result.unassigned_job_ids)} left unassigned, in {time.perf_counter() - started:.2f}s"
+        ))
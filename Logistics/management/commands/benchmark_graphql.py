@@ -0,0 +1,84 @@
+import json
+import platform
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from Logistics import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway test database and benchmark every GraphQL Query field and mutation, "
+        "in process and over HTTP. Run with DEBUG off for representative numbers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--jobs", type=int, default=1000, help="Delivery jobs to seed, e.g. 1000, 100000, 1000000")
+        parser.add_argument("--vehicles", type=int, default=None, help="Defaults to one per 100 jobs (at least 10)")
+        parser.add_argument("--iterations", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument("--mode", choices=("inprocess", "http", "both"), default="both")
+        parser.add_argument("--keep-caches", action="store_true", help="Measure warm count/response caches")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default="benchmark.json")
+        parser.add_argument("--baseline", help="Earlier --output file to compare against")
+        parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed latency growth over the baseline")
+
+    def handle(self, *args, **options):
+        jobs = options["jobs"]
+        vehicles = options["vehicles"] or max(10, jobs // 100)
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        old_name = connection.settings_dict["NAME"]
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stderr.write(f"Seeding {vehicles} vehicles and {jobs} delivery jobs")
+            benchmark.seed(jobs, vehicles, seed=options["seed"])
+            fixture = benchmark.Fixture(seed=options["seed"])
+            run = dict(iterations=options["iterations"], warmup=options["warmup"], keep_caches=options["keep_caches"])
+            results = {}
+            if options["mode"] in ("inprocess", "both"):
+                results["inprocess"] = benchmark.run_inprocess(fixture, **run)
+            if options["mode"] in ("http", "both"):
+                results["http"] = benchmark.run_http(fixture, **run)
+        except benchmark.BenchmarkError as e:
+            raise CommandError(str(e))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        report = {
+            "meta": {
+                "jobs": jobs,
+                "vehicles": vehicles,
+                "iterations": options["iterations"],
+                "keep_caches": options["keep_caches"],
+                "database": connection.vendor,
+                "python": platform.python_version(),
+                "recorded_at": timezone.now().isoformat(),
+            },
+            "results": results,
+        }
+        with open(options["output"], "w") as f:
+            json.dump(report, f, indent=2)
+
+        for mode, scenarios in results.items():
+            for name, summary in scenarios.items():
+                self.stdout.write(
+                    f"{mode:9} {name:40} p50 {summary['p50_ms']:9.2f}ms  p99 {summary['p99_ms']:9.2f}ms  "
+                    f"{summary['throughput_rps']:8.1f} req/s  sql {summary['queries'] if summary['queries'] is not None else '-'}"
+                )
+        self.stdout.write(f"Wrote {options['output']}")
+
+        if baseline is not None:
+            if baseline.get("meta", {}).get("jobs") != jobs:
+                self.stderr.write(f"Baseline was recorded with {baseline.get('meta', {}).get('jobs')} jobs; comparing anyway")
+            regressions = benchmark.compare(report, baseline, options["tolerance"])
+            if regressions:
+                raise CommandError("Regressions against the baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline"))
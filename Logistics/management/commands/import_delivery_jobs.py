@@ -0,0 +1,114 @@
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from Logistics import bulk, caching, scheduling
+from Logistics.models import Vehicle, DeliveryJob
+
+
+def read_lines(stream, offset):
+    # Yields (raw line, byte offset just past it) so a crash can resume from the last committed offset
+    stream.seek(offset)
+    while line := stream.readline():
+        offset += len(line)
+        if line.strip():
+            yield line, offset
+
+
+def csv_parser(stream):
+    # The header is always read from the start of the file, even when resuming
+    header = next(csv.reader([stream.readline().decode('utf-8-sig')]))
+    return lambda line: dict(zip(header, next(csv.reader([line.decode('utf-8')]))))
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f"invalid datetime '{value}'")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+def check_batch_size(batch_size):
+    if batch_size is not None and batch_size < 1:
+        raise CommandError("--batch-size must be at least 1")
+    return batch_size
+
+
+class Command(BaseCommand):
+    help = "Stream delivery jobs from a CSV or NDJSON file into the database in chunked bulk inserts"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=("csv", "ndjson"), help="Defaults to the file extension")
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--offset", type=int, default=0, help="Byte offset to resume from")
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        file_format = options["format"] or ("csv" if path.endswith(".csv") else "ndjson")
+        batch_size = check_batch_size(options["batch_size"]) or bulk.default_batch_size()
+        # Vehicle ids are resolved against an in-memory map instead of a lookup per row
+        vehicle_ids = {str(pk): pk for pk in Vehicle.objects.values_list("id", flat=True).iterator()}
+
+        imported = skipped = 0
+        offset = options["offset"]
+        started = time.perf_counter()
+        with open(path, "rb") as stream:
+            parse = csv_parser(stream) if file_format == "csv" else json.loads
+            lines = read_lines(stream, max(offset, stream.tell()))
+            jobs = self.build_jobs(lines, parse, vehicle_ids)
+            for chunk in bulk.chunked(jobs, batch_size):
+                valid = [(job, end) for job, end in chunk if job is not None]
+                with transaction.atomic():
+                    created, rejected = bulk.create_delivery_jobs([job for job, _ in valid], batch_size)
+                caching.invalidate('delivery_jobs')
+                for position, message in rejected:
+                    self.stderr.write(f"Skipping row ending at offset {valid[position][1]}: {message}")
+                imported += len(created)
+                skipped += len(chunk) - len(created)
+                offset = chunk[-1][1]
+                elapsed = time.perf_counter() - started
+                self.stderr.write(
+                    f"{imported} imported, {skipped} skipped, {imported / elapsed if elapsed else 0:.0f} rows/s, "
+                    f"committed through offset {offset}"
+                )
+        self.stdout.write(self.style.SUCCESS(f"Imported {imported} delivery jobs ({skipped} skipped), last offset {offset}"))
+
+    def build_jobs(self, lines, parse, vehicle_ids):
+        # Yields (DeliveryJob or None, end offset); rejected rows are reported and passed through as None
+        for line, end in lines:
+            try:
+                job = self.build_job(parse(line), vehicle_ids)
+            except (AttributeError, KeyError, ValueError, InvalidOperation, csv.Error) as e:
+                self.stderr.write(f"Skipping row ending at offset {end}: {e!r}")
+                job = None
+            yield job, end
+
+    @staticmethod
+    def build_job(record, vehicle_ids):
+        vehicle_id = record.get("vehicle_id")
+        if vehicle_id not in (None, ""):
+            if str(vehicle_id) not in vehicle_ids:
+                raise ValueError(f"vehicle {vehicle_id} does not exist")
+            vehicle_id = vehicle_ids[str(vehicle_id)]
+        else:
+            vehicle_id = None
+        job = DeliveryJob(
+            destination_location=record["destination_location"],
+            delivery_slot=parse_timestamp(record["delivery_slot"]),
+            slot_end=parse_timestamp(record.get("slot_end")),
+            income=Decimal(str(record["income"])),
+            costs=Decimal(str(record["costs"])),
+            completed_at=parse_timestamp(record.get("completed_at")),
+            vehicle_id=vehicle_id,
+        )
+        message = bulk.validate_instance(job, exclude=["vehicle", "profit"]) or scheduling.slot_error(job.delivery_slot, job.slot_end)
+        if message:
+            raise ValueError(message)
+        return job
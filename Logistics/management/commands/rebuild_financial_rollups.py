@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from Logistics import caching
+from Logistics.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Rebuild the MonthlyFinancials rollup table from DeliveryJob"
+
+    def handle(self, *args, **options):
+        count = rebuild()
+        # Rollups share the delivery job tag in the response cache
+        caching.invalidate('delivery_jobs')
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} rollup rows"))
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.10 on 2026-10-18 02:04
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_profit(apps, schema_editor):
+    DeliveryJob = apps.get_model('Logistics', 'DeliveryJob')
+    DeliveryJob.objects.update(profit=F('income') - F('costs'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Logistics', '0003_alter_deliveryjob_delivery_slot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='profit',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=11),
+        ),
+        migrations.RunPython(backfill_profit, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['profit', 'id'], name='deliveryjob_profit_id_idx'),
+        ),
+    ]
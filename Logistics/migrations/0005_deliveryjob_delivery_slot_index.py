@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Logistics', '0004_deliveryjob_profit'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryjob',
+            name='delivery_slot',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
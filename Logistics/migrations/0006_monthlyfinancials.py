@@ -0,0 +1,59 @@
+# Generated by Django 4.2.10 on 2026-10-18 02:05
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+import django.db.models.deletion
+
+
+def populate_rollups(apps, schema_editor):
+    # A frozen copy of Logistics.rollups.rebuild as it stood for this schema
+    DeliveryJob = apps.get_model('Logistics', 'DeliveryJob')
+    MonthlyFinancials = apps.get_model('Logistics', 'MonthlyFinancials')
+    grouped = (
+        DeliveryJob.objects.filter(delivery_slot__isnull=False)
+        .annotate(year=ExtractYear('delivery_slot'), month=ExtractMonth('delivery_slot'))
+        .order_by()
+    )
+    sums = dict(
+        income=Sum('income'), costs=Sum('costs'), job_count=Count('id'), completed_count=Count('completed_at')
+    )
+    rows = [MonthlyFinancials(vehicle_id=None, **row) for row in grouped.values('year', 'month').annotate(**sums)]
+    rows += [
+        MonthlyFinancials(**row)
+        for row in grouped.filter(vehicle__isnull=False).values('year', 'month', 'vehicle_id').annotate(**sums)
+    ]
+    MonthlyFinancials.objects.all().delete()
+    MonthlyFinancials.objects.bulk_create(rows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Logistics', '0005_deliveryjob_delivery_slot_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MonthlyFinancials',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.IntegerField()),
+                ('month', models.IntegerField()),
+                ('income', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('costs', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('job_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('vehicle', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='Logistics.vehicle')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyfinancials',
+            constraint=models.UniqueConstraint(fields=('year', 'month', 'vehicle'), name='monthlyfinancials_vehicle_unique'),
+        ),
+        migrations.AddConstraint(
+            model_name='monthlyfinancials',
+            constraint=models.UniqueConstraint(condition=models.Q(('vehicle__isnull', True)), fields=('year', 'month'), name='monthlyfinancials_total_unique'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
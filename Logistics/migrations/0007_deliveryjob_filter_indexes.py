@@ -0,0 +1,40 @@
+# Generated by Django 4.2.10 on 2026-10-18 02:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Logistics', '0006_monthlyfinancials'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deliveryjob',
+            name='delivery_slot',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AlterField(
+            model_name='deliveryjob',
+            name='vehicle',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='Logistics.vehicle'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['delivery_slot'], name='deliveryjob_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['vehicle', 'delivery_slot'], name='deliveryjob_vehicle_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['destination_location', 'delivery_slot'], name='deliveryjob_dest_slot_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='deliveryjob',
+            index=models.Index(fields=['completed_at'], name='deliveryjob_completed_at_idx'),
+        ),
+    ]
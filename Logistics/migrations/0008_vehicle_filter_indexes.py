@@ -0,0 +1,21 @@
+# Generated by Django 4.2.10 on 2026-10-18 02:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Logistics', '0007_deliveryjob_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['make', 'model', 'year'], name='vehicle_make_model_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['make', 'model', 'year'], name='vehicle_active_mmy_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.10 on 2026-10-18 02:26
+
+from datetime import timedelta
+from django.db import migrations, models
+from django.db.models import F
+
+
+# LOGISTICS_DEFAULT_SLOT_MINUTES when this migration was written; fixed so replays write the same data
+DEFAULT_SLOT_LENGTH = timedelta(minutes=60)
+
+
+def backfill_slot_end(apps, schema_editor):
+    DeliveryJob = apps.get_model('Logistics', 'DeliveryJob')
+    DeliveryJob.objects.filter(delivery_slot__isnull=False).update(slot_end=F('delivery_slot') + DEFAULT_SLOT_LENGTH)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Logistics', '0008_vehicle_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryjob',
+            name='slot_end',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_slot_end, migrations.RunPython.noop),
+    ]
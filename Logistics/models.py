@@ -1,4 +1,9 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
 from django.db import models
+from django.db.models import F, ExpressionWrapper
+
 
 class Vehicle(models.Model):
     # Vehicle fields
@@ -7,13 +12,108 @@ class Vehicle(models.Model):
     year = models.IntegerField(null=False, blank=False)  # 2020
     is_active = models.BooleanField(db_index=True, default=True)
 
+    class Meta:
+        # Keep in step with Logistics.planner.VEHICLE_INDEXES
+        indexes = [
+            models.Index(fields=['make', 'model', 'year'], name='vehicle_make_model_year_idx'),
+            # The fleet pickers only ever list active vehicles
+            models.Index(
+                fields=['make', 'model', 'year'], condition=models.Q(is_active=True),
+                name='vehicle_active_mmy_idx',
+            ),
+        ]
+
+
+def calculate_profit(income, costs):
+    return (Decimal(str(income)) - Decimal(str(costs))).quantize(Decimal('0.01'))
+
+
+def default_slot_end(delivery_slot):
+    # Slots may still be ISO strings when a model is built by hand
+    delivery_slot = models.DateTimeField().to_python(delivery_slot)
+    return delivery_slot + timedelta(minutes=settings.LOGISTICS_DEFAULT_SLOT_MINUTES)
+
+
+class DeliveryJobQuerySet(models.QuerySet):
+    # Keeps the stored profit column in step with income/costs on every write path
+
+    def update(self, **kwargs):
+        if ('income' in kwargs or 'costs' in kwargs) and 'profit' not in kwargs:
+            # SET expressions see the old row, so combine the new values explicitly
+            income, costs = kwargs.get('income', F('income')), kwargs.get('costs', F('costs'))
+            if hasattr(income, 'resolve_expression') or hasattr(costs, 'resolve_expression'):
+                kwargs['profit'] = ExpressionWrapper(income - costs, output_field=models.DecimalField())
+            else:
+                kwargs['profit'] = calculate_profit(income, costs)
+        return super().update(**kwargs)
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.profit = calculate_profit(obj.income, obj.costs)
+            if obj.slot_end is None and obj.delivery_slot is not None:
+                obj.slot_end = default_slot_end(obj.delivery_slot)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        fields = list(fields)
+        if ('income' in fields or 'costs' in fields) and 'profit' not in fields:
+            objs = list(objs)
+            for obj in objs:
+                obj.profit = calculate_profit(obj.income, obj.costs)
+            fields.append('profit')
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
 
 class DeliveryJob(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(blank=True, null=True)
     destination_location = models.CharField(max_length=100)
     delivery_slot = models.DateTimeField(null=True)
+    # The slot is the half-open interval [delivery_slot, slot_end); unset ends default to LOGISTICS_DEFAULT_SLOT_MINUTES
+    slot_end = models.DateTimeField(null=True, blank=True)
     income = models.DecimalField(max_digits=10, decimal_places=2)
     costs = models.DecimalField(max_digits=10, decimal_places=2)
+    profit = models.DecimalField(max_digits=11, decimal_places=2, default=0, editable=False)  # income - costs
+    # Indexed through deliveryjob_vehicle_slot_idx, whose leading column is vehicle
+    vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, null=True, db_index=False)
+
+    objects = DeliveryJobQuerySet.as_manager()
+
+    class Meta:
+        # Keep in step with Logistics.planner.INDEXES
+        indexes = [
+            models.Index(fields=['profit', 'id'], name='deliveryjob_profit_id_idx'),
+            models.Index(fields=['delivery_slot'], name='deliveryjob_slot_idx'),
+            models.Index(fields=['vehicle', 'delivery_slot'], name='deliveryjob_vehicle_slot_idx'),
+            models.Index(fields=['destination_location', 'delivery_slot'], name='deliveryjob_dest_slot_idx'),
+            models.Index(fields=['completed_at'], name='deliveryjob_completed_at_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.profit = calculate_profit(self.income, self.costs)
+        if self.slot_end is None and self.delivery_slot is not None:
+            self.slot_end = default_slot_end(self.delivery_slot)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and ('income' in update_fields or 'costs' in update_fields):
+            kwargs['update_fields'] = {*update_fields, 'profit'}
+        super().save(*args, **kwargs)
+
+
+class MonthlyFinancials(models.Model):
+    # Rollup of DeliveryJob totals per delivery_slot month; the vehicle=None row is the fleet-wide total
+    year = models.IntegerField()
+    month = models.IntegerField()
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE, null=True)
+    income = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    costs = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    job_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['year', 'month', 'vehicle'], name='monthlyfinancials_vehicle_unique'),
+            models.UniqueConstraint(
+                fields=['year', 'month'], condition=models.Q(vehicle__isnull=True), name='monthlyfinancials_total_unique'
+            ),
+        ]
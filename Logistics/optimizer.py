@@ -0,0 +1,77 @@
+from django.core.exceptions import FieldDoesNotExist
+from graphene.utils.str_converters import to_snake_case
+from graphql.language import FieldNode, FragmentSpreadNode, InlineFragmentNode
+
+
+def _collect(selection_set, fragments, tree):
+    for selection in selection_set.selections:
+        if isinstance(selection, FieldNode):
+            name = selection.name.value
+            if name.startswith('__'):
+                continue
+            subtree = tree.setdefault(to_snake_case(name), {})
+            if selection.selection_set:
+                _collect(selection.selection_set, fragments, subtree)
+        elif isinstance(selection, InlineFragmentNode):
+            _collect(selection.selection_set, fragments, tree)
+        elif isinstance(selection, FragmentSpreadNode):
+            fragment = fragments.get(selection.name.value)
+            if fragment:
+                _collect(fragment.selection_set, fragments, tree)
+    return tree
+
+
+def selected_fields(info):
+    # {snake_case_name: {...nested selection...}} for the field currently being resolved
+    tree = {}
+    for node in info.field_nodes:
+        if node.selection_set:
+            _collect(node.selection_set, info.fragments, tree)
+    return tree
+
+
+def _model_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def _plan(model, selection, prefix=''):
+    only, related = [], []
+    for name, subtree in selection.items():
+        field = _model_field(model, name)
+        if field is None or not field.concrete:
+            # Not a column (e.g. a reverse relation served by a loader); the pk is always loaded
+            continue
+        if field.is_relation:
+            if not field.many_to_one:
+                continue
+            related.append(prefix + name)
+            sub_only, sub_related = _plan(field.related_model, subtree, prefix + name + '__')
+            only.extend(sub_only or [prefix + name + '__' + field.related_model._meta.pk.name])
+            related.extend(sub_related)
+        else:
+            only.append(prefix + name)
+    return only, related
+
+
+def selected_columns(model, info):
+    # Attribute names of the model's own columns that the current selection reads
+    only, _ = _plan(model, selected_fields(info))
+    return {model._meta.get_field(name).attname for name in only if '__' not in name}
+
+
+def optimize(queryset, info, path=(), include=()):
+    # Narrow the queryset to the columns and joins the GraphQL selection actually needs.
+    # path points at the node selection inside wrappers such as connection edges,
+    # include lists columns the resolver itself reads (e.g. cursor keys).
+    selection = selected_fields(info)
+    for name in path:
+        selection = selection.get(name, {})
+    if not selection:
+        return queryset
+    only, related = _plan(queryset.model, selection)
+    if related:
+        queryset = queryset.select_related(*related)
+    return queryset.only(queryset.model._meta.pk.name, *only, *include)
@@ -0,0 +1,85 @@
+import base64
+import binascii
+import json
+from django.conf import settings
+from django.db.models import Q
+from graphene_django.settings import graphene_settings
+from graphql import GraphQLError
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor, size):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise GraphQLError(f"Invalid cursor '{cursor}'")
+    if not isinstance(values, list) or len(values) != size:
+        raise GraphQLError(f"Invalid cursor '{cursor}'")
+    return values
+
+
+def connection_limit(first, connection_name):
+    # Mirrors graphene-django's RELAY_CONNECTION_* settings for hand-built connections
+    max_limit = graphene_settings.RELAY_CONNECTION_MAX_LIMIT
+    if first is None:
+        if graphene_settings.RELAY_CONNECTION_ENFORCE_FIRST_OR_LAST:
+            raise GraphQLError(f"You must provide a `first` value to properly paginate the `{connection_name}` connection.")
+        return max_limit
+    if first < 0:
+        raise GraphQLError(f"`first` argument of `{connection_name}` must be positive.")
+    if max_limit and first > max_limit:
+        # Not a graphene-django setting, so it is read from the project's GRAPHENE dict directly
+        if settings.GRAPHENE.get('RELAY_CONNECTION_ENFORCE_MAX_LIMIT', True):
+            raise GraphQLError(
+                f"Requesting {first} records on the `{connection_name}` connection exceeds the `first` limit of {max_limit} records."
+            )
+        return max_limit
+    return first
+
+
+def seek(keys, values):
+    # (a, b) after (x, y) => a > x OR (a = x AND b > y), with < for descending keys
+    condition = Q()
+    equal = {}
+    for (field, descending), value in zip(keys, values):
+        lookup = f'{field}__lt' if descending else f'{field}__gt'
+        condition |= Q(**equal, **{lookup: value})
+        equal[field] = value
+    return condition
+
+
+def keyset_queryset(queryset, keys, first, after=None):
+    # keys is a list of (field, descending) pairs ending in a unique field, e.g. [('id', False)]
+    queryset = queryset.order_by(*[f'-{field}' if descending else field for field, descending in keys])
+    if after:
+        queryset = queryset.filter(seek(keys, decode_cursor(after, len(keys))))
+    # One extra row tells us whether there is a next page
+    return queryset[:first + 1]
+
+
+def keyset_page(rows, keys, first):
+    has_next_page = len(rows) > first
+    rows = rows[:first]
+    cursors = [encode_cursor([getattr(row, field) for field, _ in keys]) for row in rows]
+    return rows, cursors, has_next_page
+
+
+def keyset_paginate(queryset, keys, first, after=None):
+    return keyset_page(list(keyset_queryset(queryset, keys, first, after)), keys, first)
+
+
+async def akeyset_paginate(queryset, keys, first, after=None):
+    return keyset_page([row async for row in keyset_queryset(queryset, keys, first, after)], keys, first)
+
+
+async def apaginate(queryset, page, page_size):
+    # Async counterpart of Paginator.page() as the list resolvers use it: out-of-range pages fall back to the last one
+    count = await queryset.acount()
+    num_pages = max(1, -(-count // page_size))
+    if not 1 <= page <= num_pages:
+        page = num_pages
+    bottom = (page - 1) * page_size
+    return [row async for row in queryset[bottom:bottom + page_size]]
@@ -0,0 +1,66 @@
+from django.db.models import Q
+
+
+# (name, columns) for the DeliveryJob indexes declared in models.DeliveryJob.Meta
+INDEXES = (
+    ('deliveryjob_vehicle_slot_idx', ('vehicle_id', 'delivery_slot')),
+    ('deliveryjob_dest_slot_idx', ('destination_location', 'delivery_slot')),
+    ('deliveryjob_slot_idx', ('delivery_slot',)),
+    ('deliveryjob_profit_id_idx', ('profit', 'id')),
+    ('deliveryjob_completed_at_idx', ('completed_at',)),
+)
+
+# Same for Vehicle. The partial index only covers is_active = true rows, which the planner
+# models as a leading equality column.
+VEHICLE_INDEXES = (
+    ('vehicle_active_mmy_idx', ('is_active', 'make', 'model', 'year')),
+    ('vehicle_make_model_year_idx', ('make', 'model', 'year')),
+)
+
+EQUALITY_LOOKUPS = {'exact', 'in', 'isnull'}
+
+
+def split_lookup(lookup):
+    column, _, operator = lookup.partition('__')
+    return column, operator or 'exact'
+
+
+def choose_index(filters, indexes=INDEXES):
+    # An index scores 2 per leading column matched by equality and 1 for a trailing range column
+    operators = {}
+    for lookup in filters:
+        column, operator = split_lookup(lookup)
+        operators.setdefault(column, set()).add(operator)
+
+    best, best_score = (None, ()), 0
+    for name, columns in indexes:
+        score = 0
+        for column in columns:
+            used = operators.get(column)
+            if not used:
+                break
+            if used & EQUALITY_LOOKUPS:
+                score += 2
+                continue
+            score += 1
+            break
+        if score > best_score:
+            best, best_score = (name, columns), score
+    return best
+
+
+def plan(filters, indexes=INDEXES):
+    # Returns the index expected to serve the filters and the predicates in that index's column order
+    name, columns = choose_index(filters, indexes)
+
+    def position(item):
+        column, _ = split_lookup(item[0])
+        return columns.index(column) if column in columns else len(columns)
+
+    return name, sorted(filters.items(), key=position)
+
+
+def apply_filters(queryset, filters, indexes=INDEXES):
+    # Positional Q objects keep the planned order; filter(**kwargs) would sort lookups alphabetically
+    _, predicates = plan(filters, indexes)
+    return queryset.filter(*[Q(**{lookup: value}) for lookup, value in predicates])
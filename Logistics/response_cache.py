@@ -0,0 +1,88 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from graphql import ExecutionResult, TypeInfo, TypeInfoVisitor, Visitor, get_named_type, print_ast, visit
+from . import caching
+from .auth import authenticate_request
+from .models import DeliveryJob, MonthlyFinancials, Vehicle
+
+
+# Invalidation tag per model. The monthly rollups only change when delivery jobs do, so they share its tag.
+MODEL_TAGS = {
+    Vehicle: 'vehicles',
+    DeliveryJob: 'delivery_jobs',
+    MonthlyFinancials: 'delivery_jobs',
+}
+
+# Fields whose result is not a model-backed object type, or that also depend on another model
+FIELD_TAGS = {
+    'Query.totalCount': ('delivery_jobs',),
+    'Query.calculateMonthlyIncomeCosts': ('delivery_jobs',),
+    'Query.calculateYearlyIncomeCosts': ('delivery_jobs',),
+    'Query.vehicleAvailability': ('delivery_jobs',),
+    'Query.vehicleProfitability': ('delivery_jobs',),
+}
+
+
+class TagCollector(Visitor):
+    # Collects the tags of every model a document can read, following fragments and nested selections
+    def __init__(self, type_info):
+        super().__init__()
+        self.type_info = type_info
+        self.tags = set()
+
+    def enter_field(self, node, *_):
+        parent_type = self.type_info.get_parent_type()
+        if parent_type is not None:
+            self.tags.update(FIELD_TAGS.get(f'{parent_type.name}.{node.name.value}', ()))
+        field_type = self.type_info.get_type()
+        graphene_type = getattr(get_named_type(field_type), 'graphene_type', None) if field_type else None
+        model = getattr(getattr(graphene_type, '_meta', None), 'model', None)
+        if model in MODEL_TAGS:
+            self.tags.add(MODEL_TAGS[model])
+
+
+class ResponsePlan:
+    # Per-document part of the cache key, computed once when the document is first validated
+    def __init__(self, schema, document):
+        self.digest = hashlib.sha256(print_ast(document).encode()).hexdigest()
+        type_info = TypeInfo(schema)
+        collector = TagCollector(type_info)
+        visit(document, TypeInfoVisitor(type_info, collector))
+        self.tags = sorted(collector.tags)
+
+
+def subject(request):
+    # Responses are cached per authenticated user; anonymous requests share entries
+    return authenticate_request(request)
+
+
+def _key_payload(plan, request, operation_name, variables):
+    return [plan.digest, operation_name, variables or {}, subject(request)]
+
+
+def _cacheable(result):
+    return not result.errors and result.data is not None
+
+
+def get(plan, request, operation_name, variables):
+    # Returns (key, cached ExecutionResult or None)
+    key = caching.make_key('response', plan.tags, _key_payload(plan, request, operation_name, variables))
+    data = cache.get(key)
+    return key, None if data is None else ExecutionResult(data=data)
+
+
+def store(key, result):
+    if _cacheable(result):
+        cache.set(key, result.data, settings.LOGISTICS_RESPONSE_CACHE_TTL)
+
+
+async def aget(plan, request, operation_name, variables):
+    key = await caching.amake_key('response', plan.tags, _key_payload(plan, request, operation_name, variables))
+    data = await cache.aget(key)
+    return key, None if data is None else ExecutionResult(data=data)
+
+
+async def astore(key, result):
+    if _cacheable(result):
+        await cache.aset(key, result.data, settings.LOGISTICS_RESPONSE_CACHE_TTL)
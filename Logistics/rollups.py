@@ -0,0 +1,158 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+from .models import DeliveryJob, MonthlyFinancials
+
+
+class RollupDelta:
+    # Accumulates changes per (year, month, vehicle_id) so bulk paths write each rollup row once
+    def __init__(self):
+        self.rows = defaultdict(lambda: [Decimal(0), Decimal(0), 0, 0])
+
+    def add(self, job, vehicle_id, sign=1, jobs=1, completed=0):
+        if job.delivery_slot is None:
+            return
+        slot = timezone.localtime(job.delivery_slot) if timezone.is_aware(job.delivery_slot) else job.delivery_slot
+        row = self.rows[(slot.year, slot.month, vehicle_id)]
+        if jobs:
+            row[0] += sign * Decimal(str(job.income))
+            row[1] += sign * Decimal(str(job.costs))
+            row[2] += sign * jobs
+        row[3] += sign * completed
+
+    def apply(self):
+        with transaction.atomic():
+            for (year, month, vehicle_id), (income, costs, jobs, completed) in self.rows.items():
+                _apply_row(year, month, vehicle_id, income, costs, jobs, completed)
+        self.rows.clear()
+
+
+def _apply_row(year, month, vehicle_id, income, costs, jobs, completed):
+    rows = MonthlyFinancials.objects.filter(year=year, month=month, vehicle_id=vehicle_id)
+    changes = dict(
+        income=F('income') + income,
+        costs=F('costs') + costs,
+        job_count=F('job_count') + jobs,
+        completed_count=F('completed_count') + completed,
+    )
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            MonthlyFinancials.objects.create(
+                year=year, month=month, vehicle_id=vehicle_id,
+                income=income, costs=costs, job_count=jobs, completed_count=completed,
+            )
+    except IntegrityError:
+        # Another writer created the row between our update and insert
+        rows.update(**changes)
+
+
+def record_created(jobs):
+    delta = RollupDelta()
+    for job in jobs:
+        completed = 1 if job.completed_at else 0
+        delta.add(job, None, completed=completed)
+        if job.vehicle_id:
+            delta.add(job, job.vehicle_id, completed=completed)
+    delta.apply()
+
+
+def record_reassigned(jobs, previous_vehicle_ids):
+    # previous_vehicle_ids maps job id -> vehicle_id before the assignment
+    delta = RollupDelta()
+    for job in jobs:
+        previous = previous_vehicle_ids.get(job.id)
+        if previous == job.vehicle_id:
+            continue
+        completed = 1 if job.completed_at else 0
+        if previous:
+            delta.add(job, previous, sign=-1, completed=completed)
+        if job.vehicle_id:
+            delta.add(job, job.vehicle_id, completed=completed)
+    delta.apply()
+
+
+def record_completed(jobs):
+    # jobs whose completed_at has just gone from empty to set
+    delta = RollupDelta()
+    for job in jobs:
+        delta.add(job, None, jobs=0, completed=1)
+        if job.vehicle_id:
+            delta.add(job, job.vehicle_id, jobs=0, completed=1)
+    delta.apply()
+
+
+def rebuild(job_model=DeliveryJob, rollup_model=MonthlyFinancials):
+    # Recompute every rollup row from the fact table; the models are parameters so historical ones can be passed
+    grouped = (
+        job_model.objects.filter(delivery_slot__isnull=False)
+        .annotate(year=ExtractYear('delivery_slot'), month=ExtractMonth('delivery_slot'))
+        .order_by()
+    )
+    sums = dict(
+        income=Sum('income'), costs=Sum('costs'), job_count=Count('id'), completed_count=Count('completed_at')
+    )
+    rows = [rollup_model(vehicle_id=None, **row) for row in grouped.values('year', 'month').annotate(**sums)]
+    rows += [
+        rollup_model(**row)
+        for row in grouped.filter(vehicle__isnull=False).values('year', 'month', 'vehicle_id').annotate(**sums)
+    ]
+    with transaction.atomic():
+        rollup_model.objects.all().delete()
+        rollup_model.objects.bulk_create(rows, batch_size=500)
+    return len(rows)
+
+
+def _company_rows(year):
+    return MonthlyFinancials.objects.filter(year=year, vehicle__isnull=True)
+
+
+def _months(year, rows):
+    by_month = {row.month: row for row in rows}
+    return [by_month.get(month) or MonthlyFinancials(year=year, month=month) for month in range(1, 13)]
+
+
+def monthly_totals(year, month):
+    row = _company_rows(year).filter(month=month).first()
+    return row or MonthlyFinancials(year=year, month=month)
+
+
+def yearly_totals(year):
+    return _months(year, _company_rows(year))
+
+
+def vehicle_ranking(top, start=None, end=None):
+    # Per-vehicle totals of the jobs slotted in [start, end) from one GROUP BY vehicle_id, most
+    # profitable first and cut at top. Without a range the all-time totals are summed from the
+    # per-vehicle rollup rows (one per vehicle and month) instead of every job.
+    if start is None and end is None:
+        grouped = MonthlyFinancials.objects.filter(vehicle__isnull=False).values('vehicle_id').annotate(
+            total_income=Sum('income'), total_costs=Sum('costs'), job_count=Sum('job_count'),
+        )
+    else:
+        jobs = DeliveryJob.objects.filter(vehicle__isnull=False, delivery_slot__isnull=False)
+        if start is not None:
+            jobs = jobs.filter(delivery_slot__gte=start)
+        if end is not None:
+            jobs = jobs.filter(delivery_slot__lt=end)
+        grouped = jobs.values('vehicle_id').annotate(
+            total_income=Sum('income'), total_costs=Sum('costs'), job_count=Count('id'),
+        )
+    return (
+        grouped.annotate(total_profit=F('total_income') - F('total_costs'))
+        .filter(job_count__gt=0)
+        .order_by('-total_profit', 'vehicle_id')[:top]
+    )
+
+
+async def amonthly_totals(year, month):
+    row = await _company_rows(year).filter(month=month).afirst()
+    return row or MonthlyFinancials(year=year, month=month)
+
+
+async def ayearly_totals(year):
+    return _months(year, [row async for row in _company_rows(year)])
@@ -0,0 +1,113 @@
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef, Q
+from graphql import GraphQLError
+from .models import DeliveryJob, Vehicle, default_slot_end
+from .planner import apply_filters
+
+
+def max_slot_length():
+    return timedelta(minutes=settings.LOGISTICS_MAX_SLOT_MINUTES)
+
+
+WINDOW_ERROR = 'The end of a time range must be after its start'
+
+
+def check_window(start, end):
+    if end <= start:
+        raise GraphQLError(WINDOW_ERROR, extensions={'code': 'INVALID_SLOT'})
+    return start, end
+
+
+def slot_error(start, end=None):
+    # Message for an invalid delivery slot, or None; a missing end gets the default slot length
+    end = default_slot_end(start) if end is None else end
+    if end <= start:
+        return WINDOW_ERROR
+    if end - start > max_slot_length():
+        return f'Delivery slots are limited to {settings.LOGISTICS_MAX_SLOT_MINUTES} minutes'
+    return None
+
+
+def slot_bounds(start, end=None):
+    # Validated [start, end) of a delivery slot
+    end = default_slot_end(start) if end is None else end
+    message = slot_error(start, end)
+    if message:
+        raise GraphQLError(message, extensions={'code': 'INVALID_SLOT'})
+    return start, end
+
+
+def overlap_lookups(start, end):
+    # Slots overlapping [start, end). No slot is longer than the cap, so one starting at or before
+    # start - cap has already ended: that lower bound makes the check a range scan of
+    # (vehicle_id, delivery_slot) rather than every job the vehicle ever had.
+    return {
+        'delivery_slot__gt': start - max_slot_length(),
+        'delivery_slot__lt': end,
+        'slot_end__gt': start,
+    }
+
+
+def conflicting_jobs(vehicle_id, start, end, exclude_id=None):
+    queryset = apply_filters(DeliveryJob.objects.all(), {'vehicle_id': vehicle_id, **overlap_lookups(start, end)})
+    if exclude_id is not None:
+        queryset = queryset.exclude(pk=exclude_id)
+    return queryset.order_by('delivery_slot', 'id')
+
+
+def check_vehicle_free(vehicle_id, start, end, exclude_id=None):
+    # Run inside the booking transaction, after locking the vehicle row, so that two bookings
+    # of the same vehicle cannot both pass the check
+    end = default_slot_end(start) if end is None else end
+    conflicts = list(conflicting_jobs(vehicle_id, start, end, exclude_id).values_list('id', flat=True))
+    if conflicts:
+        raise GraphQLError(
+            f"Vehicle {vehicle_id} is already booked between {start.isoformat()} and {end.isoformat()}"
+            f" by delivery jobs {conflicts}",
+            extensions={'code': 'SLOT_CONFLICT', 'conflictingJobIds': conflicts},
+        )
+
+
+def available_vehicles(vehicles, start, end):
+    # A single statement: the vehicles anti-joined (NOT EXISTS) with their overlapping jobs,
+    # probed through the same (vehicle_id, delivery_slot) index as the booking check
+    busy = apply_filters(DeliveryJob.objects.all(), {'vehicle_id': OuterRef('pk'), **overlap_lookups(start, end)})
+    return vehicles.filter(~Exists(busy))
+
+
+def batch_conflicts(jobs):
+    # {position: message} for the unsaved jobs whose slot overlaps a stored booking of the same
+    # vehicle or an earlier job of the batch. Run inside the writing transaction: the vehicles are locked as single bookings lock them, then their bookings
+    # around the batch are read in one query, one overlap window per vehicle.
+    slots = {}
+    for position, job in enumerate(jobs):
+        if job.vehicle_id is not None and job.delivery_slot is not None:
+            end = job.slot_end or default_slot_end(job.delivery_slot)
+            slots.setdefault(job.vehicle_id, []).append((position, job.delivery_slot, end))
+    if not slots:
+        return {}
+    if connection.features.has_select_for_update:
+        list(Vehicle.objects.select_for_update().filter(id__in=slots).order_by('id').values_list('id', flat=True))
+    windows = Q()
+    for vehicle_id, items in slots.items():
+        start, end = min(item[1] for item in items), max(item[2] for item in items)
+        windows |= Q(vehicle_id=vehicle_id, **overlap_lookups(start, end))
+    booked = {}
+    for job_id, vehicle_id, start, end in DeliveryJob.objects.filter(windows).values_list('id', 'vehicle_id', 'delivery_slot', 'slot_end'):
+        booked.setdefault(vehicle_id, []).append((start, end or default_slot_end(start), f'delivery job {job_id}'))
+
+    conflicts = {}
+    for vehicle_id, items in slots.items():
+        taken = booked.get(vehicle_id, [])
+        for position, start, end in items:
+            clashes = [label for booked_start, booked_end, label in taken if booked_start < end and start < booked_end]
+            if clashes:
+                conflicts[position] = (
+                    f"Vehicle {vehicle_id} is already booked between {start.isoformat()} and {end.isoformat()}"
+                    f" by {', '.join(clashes)}"
+                )
+            else:
+                taken.append((start, end, 'an earlier job of the same batch'))
+    return conflicts
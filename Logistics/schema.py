@@ -2,23 +2,38 @@ import graphene
 import json
 from django.core.paginator import Paginator, EmptyPage
 from graphene_django.types import DjangoObjectType
-from django.db.models import Sum, F, ExpressionWrapper, DecimalField
 from graphene import JSONString
+from graphql import GraphQLError
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
 from .models import Vehicle, DeliveryJob
-from datetime import datetime
-from decimal import Decimal
 from .decorators import jwt_auth_required
+from .loaders import get_loaders, with_operation_root
+from .optimizer import optimize, selected_columns
+from .pagination import akeyset_paginate, apaginate, connection_limit, keyset_paginate
+from .planner import VEHICLE_INDEXES, apply_filters
+from . import bulk, caching, dispatch, rollups, scheduling
 from django.http import JsonResponse
 
 
-def filter_delivery_jobs(**kwargs):
+def delivery_job_lookups(**kwargs):
+    # Translate filter arguments into ORM lookups
     destination_location = kwargs.get('destination_location')
     delivery_slot = kwargs.get('delivery_slot')
     income = kwargs.get('income')
     costs = kwargs.get('costs')
     vehicle_id = kwargs.get('vehicle_id')
-    # Define ordering here
-    order_by_most_profitable_vehicle = kwargs.get('orderByMostProfitableVehicle') is True
+    min_profit = kwargs.get('min_profit')
+    max_profit = kwargs.get('max_profit')
+    delivery_slot_from = kwargs.get('delivery_slot_from')
+    delivery_slot_to = kwargs.get('delivery_slot_to')
+    min_income = kwargs.get('min_income')
+    max_costs = kwargs.get('max_costs')
+    vehicle_ids = kwargs.get('vehicle_ids')
+    destinations = kwargs.get('destinations')
+    completed = kwargs.get('completed')
     filters = {}
     if destination_location:
         filters['destination_location'] = destination_location
@@ -30,113 +45,429 @@ def filter_delivery_jobs(**kwargs):
         filters['costs'] = costs
     if vehicle_id:
         filters['vehicle_id'] = vehicle_id
+    if min_profit is not None:
+        filters['profit__gte'] = min_profit
+    if max_profit is not None:
+        filters['profit__lte'] = max_profit
+    # Ranges are half-open [from, to) and lists are deduplicated and sorted so equal filters share a cache key
+    if delivery_slot_from is not None:
+        filters['delivery_slot__gte'] = delivery_slot_from
+    if delivery_slot_to is not None:
+        filters['delivery_slot__lt'] = delivery_slot_to
+    if min_income is not None:
+        filters['income__gte'] = min_income
+    if max_costs is not None:
+        filters['costs__lte'] = max_costs
+    if vehicle_ids is not None:
+        filters['vehicle_id__in'] = sorted(set(vehicle_ids))
+    if destinations is not None:
+        filters['destination_location__in'] = sorted(set(destinations))
+    if completed is not None:
+        filters['completed_at__isnull'] = not completed
+    return filters
 
-    queryset = DeliveryJob.objects.all().filter(**filters) if filters else DeliveryJob.objects.all()
+
+def filter_delivery_jobs(**kwargs):
+    # Define ordering here
+    order_by_most_profitable_vehicle = kwargs.get('orderByMostProfitableVehicle') is True
+    queryset = apply_filters(DeliveryJob.objects.all(), delivery_job_lookups(**kwargs))
 
     if order_by_most_profitable_vehicle:
-        queryset = queryset.annotate(
-            total_profit=ExpressionWrapper(F('income') - F('costs'), output_field=DecimalField())
-        ).order_by('-total_profit')
+        # Served from the (profit, id) index on the stored profit column
+        queryset = queryset.order_by('-profit', '-id')
     else:
-        queryset = queryset.annotate(
-            total_profit=ExpressionWrapper(F('income') - F('costs'), output_field=DecimalField())
-        ).order_by('id')
+        queryset = queryset.order_by('id')
     return queryset, kwargs
 
 
+def vehicle_lookups(**kwargs):
+    # allVehicles filter arguments, in the column order of the vehicle indexes
+    filters = {}
+    for field in ('is_active', 'make', 'model', 'year'):
+        if kwargs.get(field) is not None:
+            filters[field] = kwargs[field]
+    return filters
+
+
+def filter_vehicles(**kwargs):
+    return apply_filters(Vehicle.objects.all(), vehicle_lookups(**kwargs), VEHICLE_INDEXES).order_by('id')
+
+
+def available_vehicles(start, end, **kwargs):
+    # Vehicles with no job overlapping [start, end); only active ones unless isActive says otherwise
+    start, end = scheduling.check_window(start, end)
+    if kwargs.get('is_active') is None:
+        kwargs['is_active'] = True
+    return scheduling.available_vehicles(filter_vehicles(**kwargs), start, end)
+
+
+def list_limit(num_rows=None, argument='numRows'):
+    # Rows to return for an optional size argument, capped at LOGISTICS_MAX_LIST_SIZE
+    if num_rows is None:
+        return settings.LOGISTICS_MAX_LIST_SIZE
+    if num_rows < 1:
+        raise GraphQLError(f"`{argument}` must be at least 1.")
+    return min(num_rows, settings.LOGISTICS_MAX_LIST_SIZE)
+
+
+def batch_limit(batch_size=None):
+    # Rows per bulk statement: LOGISTICS_BULK_BATCH_SIZE when unset
+    if batch_size is None:
+        return bulk.default_batch_size()
+    if batch_size < 1:
+        raise GraphQLError("`batchSize` must be at least 1.")
+    return batch_size
+
+
+def page_limit(page_size=None):
+    # Rows per page: 10 when unset, never more than LOGISTICS_MAX_LIST_SIZE
+    if not page_size:
+        return 10
+    return list_limit(page_size, 'pageSize')
+
+
+def count_delivery_jobs(**kwargs):
+    # Cached per normalized lookup set (paging and ordering are ignored);
+    # writes bump the 'delivery_jobs' generation to invalidate
+    lookups = delivery_job_lookups(**kwargs)
+    key = caching.make_key('count', ['delivery_jobs'], lookups)
+    count = cache.get(key)
+    if count is None:
+        count = apply_filters(DeliveryJob.objects.all(), lookups).count()
+        cache.set(key, count, settings.LOGISTICS_COUNT_CACHE_TTL)
+    return count
+
+
+async def acount_delivery_jobs(**kwargs):
+    lookups = delivery_job_lookups(**kwargs)
+    key = await caching.amake_key('count', ['delivery_jobs'], lookups)
+    count = await cache.aget(key)
+    if count is None:
+        count = await apply_filters(DeliveryJob.objects.all(), lookups).acount()
+        await cache.aset(key, count, settings.LOGISTICS_COUNT_CACHE_TTL)
+    return count
+
+
+def prime_vehicles(info, jobs):
+    # Queue every job's vehicle so the first DeliveryJobType.vehicle lookup fetches them all at once
+    jobs = list(jobs)
+    if jobs and 'vehicle_id' not in jobs[0].get_deferred_fields():
+        get_loaders(info).vehicles.queue(job.vehicle_id for job in jobs)
+    return jobs
+
+
+def prime_delivery_jobs(info, vehicles):
+    vehicles = list(vehicles)
+    loaders = get_loaders(info)
+    for vehicle in vehicles:
+        if vehicle.get_deferred_fields():
+            # Narrowed by optimize(): only reused by selections it fully covers, otherwise
+            # the full rows of the whole page are fetched in one batch
+            loaders.vehicles.prime_narrowed(vehicle.id, vehicle)
+        else:
+            loaders.vehicles.prime(vehicle.id, vehicle)
+    loaders.delivery_jobs_by_vehicle.queue(vehicle.id for vehicle in vehicles)
+    return vehicles
+
+
 class VehicleType(DjangoObjectType):
+    delivery_jobs = graphene.List(lambda: DeliveryJobType)
+
     class Meta:
         model = Vehicle
         fields = ("id", "make", "model", "year", "is_active")
 
+    def resolve_delivery_jobs(root, info):
+        return get_loaders(info).delivery_jobs_by_vehicle.load(root.id)
+
 
 class DeliveryJobType(DjangoObjectType):
     class Meta:
         model = DeliveryJob
-        fields = ("id", "created_at", "destination_location", "delivery_slot", "income", "costs", "completed_at", "vehicle")
+        fields = ("id", "created_at", "destination_location", "delivery_slot", "slot_end", "income", "costs", "profit", "completed_at", "vehicle")
+
+    def resolve_vehicle(root, info):
+        if DeliveryJob.vehicle.is_cached(root):
+            return root.vehicle
+        return get_loaders(info).vehicles.load_fields(root.vehicle_id, selected_columns(Vehicle, info))
+
+
+class DeliveryJobConnection(graphene.relay.Connection):
+    class Meta:
+        node = DeliveryJobType
+
+
+class VehicleConnection(graphene.relay.Connection):
+    class Meta:
+        node = VehicleType
+
+
+def vehicle_filter_arguments():
+    return dict(
+        make=graphene.String(),
+        model=graphene.String(),
+        year=graphene.Int(),
+        is_active=graphene.Boolean(),
+    )
+
+
+def delivery_job_filter_arguments():
+    return dict(
+        destination_location=graphene.String(),
+        delivery_slot=graphene.DateTime(),
+        income=graphene.Decimal(),
+        costs=graphene.Decimal(),
+        vehicle_id=graphene.ID(),
+        min_profit=graphene.Decimal(),
+        max_profit=graphene.Decimal(),
+        delivery_slot_from=graphene.DateTime(),
+        delivery_slot_to=graphene.DateTime(),
+        min_income=graphene.Decimal(),
+        max_costs=graphene.Decimal(),
+        vehicle_ids=graphene.List(graphene.NonNull(graphene.ID)),
+        destinations=graphene.List(graphene.NonNull(graphene.String)),
+        completed=graphene.Boolean(),
+        orderByMostProfitableVehicle=graphene.Boolean(),
+    )
+
+
+def delivery_job_connection_keys(**kwargs):
+    if kwargs.get('orderByMostProfitableVehicle') is True:
+        return [('profit', True), ('id', True)]
+    return [('id', False)]
+
+
+def build_connection(connection_type, nodes, cursors, has_next_page, after):
+    edges = [connection_type.Edge(node=node, cursor=cursor) for node, cursor in zip(nodes, cursors)]
+    page_info = graphene.relay.PageInfo(
+        has_next_page=has_next_page,
+        has_previous_page=after is not None,
+        start_cursor=cursors[0] if cursors else None,
+        end_cursor=cursors[-1] if cursors else None,
+    )
+    return connection_type(edges=edges, page_info=page_info)
+
+
+# allVehiclesConnection walks vehicles by id
+VEHICLE_CONNECTION_KEYS = [('id', False)]
 
 
 class MonthlyIncomeCosts(graphene.ObjectType):
+    year = graphene.Int()
+    month = graphene.Int()
+    total_income = graphene.Float()
+    total_costs = graphene.Float()
+    job_count = graphene.Int()
+    completed_count = graphene.Int()
+
+    @staticmethod
+    def period(month=None, year=None):
+        # Defaults to the current local month/year
+        now = timezone.localtime()
+        month = now.month if month is None else month
+        year = now.year if year is None else year
+        if not 1 <= month <= 12:
+            raise GraphQLError(f"Invalid month {month}")
+        return year, month
+
+    @staticmethod
+    def from_rollup(row):
+        return MonthlyIncomeCosts(
+            year=row.year, month=row.month, total_income=row.income, total_costs=row.costs,
+            job_count=row.job_count, completed_count=row.completed_count,
+        )
+
+
+class VehicleProfitability(graphene.ObjectType):
+    vehicle = graphene.Field(VehicleType)
     total_income = graphene.Float()
     total_costs = graphene.Float()
+    total_profit = graphene.Float()
+    job_count = graphene.Int()
+
+    def resolve_vehicle(root, info):
+        return get_loaders(info).vehicles.load(root['vehicle_id'])
+
+
+def prime_ranking(info, rows):
+    # The ranked vehicles are fetched together by one loader batch
+    rows = list(rows)
+    get_loaders(info).vehicles.queue(row['vehicle_id'] for row in rows)
+    return rows
 
 
 class Query(graphene.ObjectType):
-    calculate_monthly_income_costs = graphene.Field(MonthlyIncomeCosts, month=graphene.Int())
+    calculate_monthly_income_costs = graphene.Field(MonthlyIncomeCosts, month=graphene.Int(), year=graphene.Int())
+    calculate_yearly_income_costs = graphene.List(MonthlyIncomeCosts, year=graphene.Int())
     totalCount = graphene.Int()
 
     all_vehicles = graphene.List(
         VehicleType,
-        make=graphene.String(),
-        model=graphene.String(),
-        year=graphene.Int(),
-        is_active=graphene.Boolean(),
         page=graphene.Int(),
         page_size=graphene.Int(),
+        **vehicle_filter_arguments()
+    )
+    all_vehicles_connection = graphene.Field(
+        VehicleConnection,
+        first=graphene.Int(),
+        after=graphene.String(),
+        **vehicle_filter_arguments()
+    )
+    vehicle_availability = graphene.List(
+        VehicleType,
+        start=graphene.DateTime(required=True, name='from'),
+        end=graphene.DateTime(required=True, name='to'),
+        num_rows=graphene.Int(),
+        **vehicle_filter_arguments()
+    )
+    vehicle_profitability = graphene.List(
+        VehicleProfitability,
+        start=graphene.DateTime(name='from'),
+        end=graphene.DateTime(name='to'),
+        top=graphene.Int(),
     )
     all_delivery_jobs = graphene.List(
         DeliveryJobType,
-        destination_location=graphene.String(),
-        delivery_slot=graphene.DateTime(),
-        income=graphene.Decimal(),
-        costs=graphene.Decimal(),
-        vehicle_id=graphene.ID(),
         num_rows=graphene.Int(),
         page=graphene.Int(),
         page_size=graphene.Int(),
-        orderByMostProfitableVehicle=graphene.Boolean()
+        **delivery_job_filter_arguments()
+    )
+    all_delivery_jobs_connection = graphene.Field(
+        DeliveryJobConnection,
+        first=graphene.Int(),
+        after=graphene.String(),
+        **delivery_job_filter_arguments()
     )
 
     #@jwt_auth_required
     def resolve_totalCount(root, info):
-        queryset, _ = filter_delivery_jobs(**info.variable_values)
-        return queryset.count()
+        return count_delivery_jobs(**info.variable_values)
 
     #@jwt_auth_required
-    def resolve_calculate_monthly_income_costs(root, info, month=None):
-        # Get the current month if month is not provided
-        if month is None:
-            month = datetime.now().month
+    def resolve_calculate_monthly_income_costs(root, info, month=None, year=None):
+        year, month = MonthlyIncomeCosts.period(month, year)
+        # Read the precomputed rollup row instead of aggregating DeliveryJob
+        return MonthlyIncomeCosts.from_rollup(rollups.monthly_totals(year, month))
 
-        # Calculate the sum of incomes and costs for the given month
-        total_income = DeliveryJob.objects.filter(delivery_slot__month=month).aggregate(total_income=Sum('income'))[
-                           'total_income'] or Decimal(0)
-        total_costs = DeliveryJob.objects.filter(delivery_slot__month=month).aggregate(total_costs=Sum('costs'))[
-                          'total_costs'] or Decimal(0)
-        # Return both total income and total costs
-        return MonthlyIncomeCosts(total_income=total_income, total_costs=total_costs)
+    #@jwt_auth_required
+    def resolve_calculate_yearly_income_costs(root, info, year=None):
+        year = timezone.localtime().year if year is None else year
+        return [MonthlyIncomeCosts.from_rollup(row) for row in rollups.yearly_totals(year)]
 
     #@jwt_auth_required
     def resolve_all_vehicles(root, info, **kwargs):
-        queryset = Vehicle.objects.all().order_by('id')
+        queryset = optimize(filter_vehicles(**kwargs), info)
         page = kwargs.get('page')
-        page_size = kwargs.get('page_size')
-        page_size = 10 if not page_size else page_size
-        paginator = Paginator(queryset, page_size)
+        paginator = Paginator(queryset, page_limit(kwargs.get('page_size')))
         if page:
             try:
                 page_obj = paginator.page(page)
             except EmptyPage:
                 page_obj = paginator.page(paginator.num_pages)
-            return page_obj.object_list
+            return prime_delivery_jobs(info, page_obj.object_list)
         else:
-            return queryset
+            return prime_delivery_jobs(info, queryset[:settings.LOGISTICS_MAX_LIST_SIZE])
+
+    #@jwt_auth_required
+    def resolve_vehicle_availability(root, info, start, end, num_rows=None, **kwargs):
+        queryset = optimize(available_vehicles(start, end, **kwargs), info)
+        return prime_delivery_jobs(info, queryset[:list_limit(num_rows)])
+
+    #@jwt_auth_required
+    def resolve_vehicle_profitability(root, info, start=None, end=None, top=None):
+        return prime_ranking(info, rollups.vehicle_ranking(list_limit(top, 'top'), start, end))
 
     #@jwt_auth_required
     def resolve_all_delivery_jobs(root, info, **kwargs):
         page = kwargs.get('page')
-        page_size = kwargs.get('page_size')
-        page_size = 10 if not page_size else page_size
         queryset, _ = filter_delivery_jobs(**kwargs)
+        queryset = optimize(queryset, info)
         if page:
-            paginator = Paginator(queryset, page_size)
+            paginator = Paginator(queryset, page_limit(kwargs.get('page_size')))
             try:
                 page_obj = paginator.page(page)
             except EmptyPage:
                 page_obj = paginator.page(paginator.num_pages)
-            return page_obj.object_list
+            return prime_vehicles(info, page_obj.object_list)
+        else:
+            # Unpaginated listings return at most num_rows, never more than the hard cap
+            return prime_vehicles(info, queryset[:list_limit(kwargs.get('num_rows'))])
+
+    #@jwt_auth_required
+    def resolve_all_delivery_jobs_connection(root, info, first=None, after=None, **kwargs):
+        # Keyset pagination: seeks past the cursor with an indexed WHERE instead of COUNT + OFFSET
+        first = connection_limit(first, 'allDeliveryJobsConnection')
+        queryset, _ = filter_delivery_jobs(**kwargs)
+        keys = delivery_job_connection_keys(**kwargs)
+        queryset = optimize(queryset, info, path=('edges', 'node'), include=[field for field, _ in keys])
+        jobs, cursors, has_next_page = keyset_paginate(queryset, keys, first, after)
+        return build_connection(DeliveryJobConnection, prime_vehicles(info, jobs), cursors, has_next_page, after)
+
+    #@jwt_auth_required
+    def resolve_all_vehicles_connection(root, info, first=None, after=None, **kwargs):
+        first = connection_limit(first, 'allVehiclesConnection')
+        queryset = optimize(filter_vehicles(**kwargs), info, path=('edges', 'node'))
+        vehicles, cursors, has_next_page = keyset_paginate(queryset, VEHICLE_CONNECTION_KEYS, first, after)
+        return build_connection(VehicleConnection, prime_delivery_jobs(info, vehicles), cursors, has_next_page, after)
+
+
+class AsyncQuery(Query):
+    # Query served by the ASGI view: the same fields resolved with Django's async ORM.
+    # graphql-core gathers sibling root fields, so e.g. totalCount and allDeliveryJobs run concurrently.
+    class Meta:
+        name = 'Query'
+
+    async def resolve_totalCount(root, info):
+        return await acount_delivery_jobs(**info.variable_values)
+
+    async def resolve_calculate_monthly_income_costs(root, info, month=None, year=None):
+        year, month = MonthlyIncomeCosts.period(month, year)
+        return MonthlyIncomeCosts.from_rollup(await rollups.amonthly_totals(year, month))
+
+    async def resolve_calculate_yearly_income_costs(root, info, year=None):
+        year = timezone.localtime().year if year is None else year
+        return [MonthlyIncomeCosts.from_rollup(row) for row in await rollups.ayearly_totals(year)]
+
+    async def resolve_all_vehicles(root, info, **kwargs):
+        queryset = optimize(filter_vehicles(**kwargs), info)
+        page = kwargs.get('page')
+        if page:
+            vehicles = await apaginate(queryset, page, page_limit(kwargs.get('page_size')))
         else:
-            return queryset
+            vehicles = [vehicle async for vehicle in queryset[:settings.LOGISTICS_MAX_LIST_SIZE]]
+        return prime_delivery_jobs(info, vehicles)
+
+    async def resolve_vehicle_availability(root, info, start, end, num_rows=None, **kwargs):
+        queryset = optimize(available_vehicles(start, end, **kwargs), info)
+        return prime_delivery_jobs(info, [vehicle async for vehicle in queryset[:list_limit(num_rows)]])
+
+    async def resolve_vehicle_profitability(root, info, start=None, end=None, top=None):
+        return prime_ranking(info, [row async for row in rollups.vehicle_ranking(list_limit(top, 'top'), start, end)])
+
+    async def resolve_all_delivery_jobs(root, info, **kwargs):
+        page = kwargs.get('page')
+        queryset, _ = filter_delivery_jobs(**kwargs)
+        queryset = optimize(queryset, info)
+        if page:
+            jobs = await apaginate(queryset, page, page_limit(kwargs.get('page_size')))
+        else:
+            jobs = [job async for job in queryset[:list_limit(kwargs.get('num_rows'))]]
+        return prime_vehicles(info, jobs)
+
+    async def resolve_all_delivery_jobs_connection(root, info, first=None, after=None, **kwargs):
+        first = connection_limit(first, 'allDeliveryJobsConnection')
+        queryset, _ = filter_delivery_jobs(**kwargs)
+        keys = delivery_job_connection_keys(**kwargs)
+        queryset = optimize(queryset, info, path=('edges', 'node'), include=[field for field, _ in keys])
+        jobs, cursors, has_next_page = await akeyset_paginate(queryset, keys, first, after)
+        return build_connection(DeliveryJobConnection, prime_vehicles(info, jobs), cursors, has_next_page, after)
+
+    async def resolve_all_vehicles_connection(root, info, first=None, after=None, **kwargs):
+        first = connection_limit(first, 'allVehiclesConnection')
+        queryset = optimize(filter_vehicles(**kwargs), info, path=('edges', 'node'))
+        vehicles, cursors, has_next_page = await akeyset_paginate(queryset, VEHICLE_CONNECTION_KEYS, first, after)
+        return build_connection(VehicleConnection, prime_delivery_jobs(info, vehicles), cursors, has_next_page, after)
 
 
 class CreateVehicle(graphene.Mutation):
@@ -153,6 +484,7 @@ class CreateVehicle(graphene.Mutation):
     def mutate(root, info, make, model, year):
         vehicle = Vehicle(make=make, model=model, year=year)
         vehicle.save()
+        caching.invalidate('vehicles')
 
         vehicle_data = {
             "id": vehicle.id,
@@ -172,20 +504,31 @@ class CreateDeliveryJob(graphene.Mutation):
         income = graphene.Decimal()
         costs = graphene.Decimal()
         vehicle_id = graphene.ID()
+        slot_end = graphene.DateTime()
 
     delivery_job = graphene.Field(DeliveryJobType)
     delivery_job_data = JSONString()
 
     @staticmethod
     #@jwt_auth_required
-    def mutate(root, info, destination_location, delivery_slot, income, costs, vehicle_id):
-        vehicle = Vehicle.objects.get(pk=vehicle_id)
-        delivery_job = DeliveryJob(destination_location=destination_location, delivery_slot=delivery_slot, income=income, costs=costs, vehicle=vehicle)
-        delivery_job.save()
+    def mutate(root, info, destination_location, delivery_slot, income, costs, vehicle_id, slot_end=None):
+        delivery_slot, slot_end = scheduling.slot_bounds(delivery_slot, slot_end)
+        with transaction.atomic():
+            # The row lock serializes bookings of this vehicle until the job is saved
+            vehicle = Vehicle.objects.select_for_update().get(pk=vehicle_id)
+            scheduling.check_vehicle_free(vehicle.id, delivery_slot, slot_end)
+            delivery_job = DeliveryJob(
+                destination_location=destination_location, delivery_slot=delivery_slot, slot_end=slot_end,
+                income=income, costs=costs, vehicle=vehicle,
+            )
+            delivery_job.save()
+            rollups.record_created([delivery_job])
+        caching.invalidate('delivery_jobs')
         delivery_job_data = {
             "id": delivery_job.id,
             "destination_location": delivery_job.destination_location,
             "delivery_slot": delivery_job.delivery_slot.isoformat(),
+            "slot_end": delivery_job.slot_end.isoformat(),
             "income": float(delivery_job.income),
             "costs": float(delivery_job.costs),
         }
@@ -202,40 +545,193 @@ class AssignVehicleToJob(graphene.Mutation):
     @staticmethod
     #@jwt_auth_required
     def mutate(root, info, job_id, vehicle_id):
-        # Get the delivery job and vehicle objects
-        job = DeliveryJob.objects.get(pk=job_id)
-        vehicle = Vehicle.objects.get(pk=vehicle_id)
-        # Assign the vehicle to the job
-        job.vehicle = vehicle
-        job.save()
+        with transaction.atomic():
+            # Get the delivery job and lock the vehicle so that concurrent bookings see this one
+            job = DeliveryJob.objects.get(pk=job_id)
+            vehicle = Vehicle.objects.select_for_update().get(pk=vehicle_id)
+            if job.delivery_slot is not None:
+                scheduling.check_vehicle_free(vehicle.id, job.delivery_slot, job.slot_end, exclude_id=job.id)
+            # Assign the vehicle to the job
+            previous_vehicle_id = job.vehicle_id
+            job.vehicle = vehicle
+            job.save()
+            rollups.record_reassigned([job], {job.id: previous_vehicle_id})
+        caching.invalidate('delivery_jobs')
         return AssignVehicleToJob(delivery_job=job)
 
 
 class MarkDeliveryJobsAsCompleted(graphene.Mutation):
     class Arguments:
         job_ids = graphene.List(graphene.Int, required=True)
+        completed_at = graphene.DateTime()
 
     success = graphene.Boolean()
     msg = graphene.String()
+    updated_ids = graphene.List(graphene.Int)
+    already_completed_ids = graphene.List(graphene.Int)
+    missing_ids = graphene.List(graphene.Int)
 
     @staticmethod
     #@jwt_auth_required
-    def mutate(root, info, job_ids):
-        try:
-            # Update the DeliveryJob objects with the given IDs to mark them as completed
-            delivery_jobs = DeliveryJob.objects.filter(id__in=job_ids)
-            if delivery_jobs.count() > 0:
-                delivery_jobs.update(completed_at=datetime.now())  # Set completed_at to current datetime
-                success = True
-                msg = "Completed successfully"
-            else:
-                msg=f"{job_ids} does not exist"
-                success = False
-        except Exception as e:
-            print(e)
+    def mutate(root, info, job_ids, completed_at=None):
+        # completedAt lets offline devices replay when the jobs were actually completed
+        completed_at = completed_at or timezone.now()
+        if timezone.is_naive(completed_at):
+            completed_at = timezone.make_aware(completed_at)
+        job_ids = list(dict.fromkeys(job_id for job_id in job_ids if job_id is not None))
+        found, updated = set(), set()
+        with transaction.atomic():
+            newly_completed = []
+            # Chunks keep each id__in under SQLite's bound-parameter limit: one locking read and at most one UPDATE each
+            for chunk in bulk.chunked(job_ids, bulk.default_batch_size()):
+                jobs = DeliveryJob.objects.select_for_update().filter(id__in=chunk).only('completed_at', 'delivery_slot', 'vehicle_id')
+                pending = []
+                for job in jobs:
+                    found.add(job.id)
+                    if job.completed_at is None:
+                        pending.append(job)
+                if pending:
+                    DeliveryJob.objects.filter(id__in=[job.id for job in pending]).update(completed_at=completed_at)
+                    updated.update(job.id for job in pending)
+                    newly_completed.extend(pending)
+            rollups.record_completed(newly_completed)
+        if updated:
+            caching.invalidate('delivery_jobs')
+
+        missing = [job_id for job_id in job_ids if job_id not in found]
+        if found:
+            success = True
+            msg = "Completed successfully" if not missing else f"Completed successfully; {missing} does not exist"
+        else:
             success = False
+            msg = f"{job_ids} does not exist"
+        return MarkDeliveryJobsAsCompleted(
+            success=success,
+            msg=msg,
+            updated_ids=[job_id for job_id in job_ids if job_id in updated],
+            already_completed_ids=[job_id for job_id in job_ids if job_id in found and job_id not in updated],
+            missing_ids=missing,
+        )
 
-        return MarkDeliveryJobsAsCompleted(success=success, msg=msg)
+
+class VehicleInput(graphene.InputObjectType):
+    make = graphene.String(required=True)
+    model = graphene.String(required=True)
+    year = graphene.Int(required=True)
+    is_active = graphene.Boolean()
+
+
+class DeliveryJobInput(graphene.InputObjectType):
+    destination_location = graphene.String(required=True)
+    delivery_slot = graphene.DateTime(required=True)
+    income = graphene.Decimal(required=True)
+    costs = graphene.Decimal(required=True)
+    vehicle_id = graphene.ID()
+    slot_end = graphene.DateTime()
+
+
+class BulkItemError(graphene.ObjectType):
+    index = graphene.Int()
+    message = graphene.String()
+
+
+class BulkCreateVehicles(graphene.Mutation):
+    class Arguments:
+        vehicles = graphene.List(graphene.NonNull(VehicleInput), required=True)
+        batch_size = graphene.Int()
+
+    vehicles = graphene.List(VehicleType)
+    errors = graphene.List(BulkItemError)
+
+    @staticmethod
+    #@jwt_auth_required
+    def mutate(root, info, vehicles, batch_size=None):
+        batch_size = batch_limit(batch_size)
+        valid, errors = [], []
+        for index, item in enumerate(vehicles):
+            vehicle = Vehicle(make=item.make, model=item.model, year=item.year)
+            if item.is_active is not None:
+                vehicle.is_active = item.is_active
+            message = bulk.validate_instance(vehicle)
+            if message:
+                errors.append(BulkItemError(index=index, message=message))
+            else:
+                valid.append(vehicle)
+        with transaction.atomic():
+            created = bulk.create_vehicles(valid, batch_size)
+        caching.invalidate('vehicles')
+        return BulkCreateVehicles(vehicles=created, errors=errors)
+
+
+class BulkCreateDeliveryJobs(graphene.Mutation):
+    class Arguments:
+        delivery_jobs = graphene.List(graphene.NonNull(DeliveryJobInput), required=True)
+        batch_size = graphene.Int()
+
+    delivery_jobs = graphene.List(DeliveryJobType)
+    errors = graphene.List(BulkItemError)
+
+    @staticmethod
+    #@jwt_auth_required
+    def mutate(root, info, delivery_jobs, batch_size=None):
+        batch_size = batch_limit(batch_size)
+        vehicles = bulk.existing_vehicles(bulk.parse_id(item.vehicle_id) for item in delivery_jobs)
+        loaders = get_loaders(info)
+        for vehicle in vehicles.values():
+            loaders.vehicles.prime(vehicle.id, vehicle)
+
+        valid, indexes, errors = [], [], []
+        for index, item in enumerate(delivery_jobs):
+            vehicle_id = bulk.parse_id(item.vehicle_id)
+            if item.vehicle_id is not None and vehicle_id not in vehicles:
+                errors.append(BulkItemError(index=index, message=f"Vehicle {item.vehicle_id} does not exist"))
+                continue
+            job = DeliveryJob(
+                destination_location=item.destination_location, delivery_slot=item.delivery_slot,
+                slot_end=item.slot_end, income=item.income, costs=item.costs, vehicle_id=vehicle_id,
+            )
+            message = bulk.validate_instance(job, exclude=['vehicle', 'profit']) or scheduling.slot_error(item.delivery_slot, item.slot_end)
+            if message:
+                errors.append(BulkItemError(index=index, message=message))
+            else:
+                valid.append(job)
+                indexes.append(index)
+        with transaction.atomic():
+            created, rejected = bulk.create_delivery_jobs(valid, batch_size)
+        caching.invalidate('delivery_jobs')
+        # Overlaps are reported against the input list, like every other per-item error
+        errors.extend(BulkItemError(index=indexes[position], message=message) for position, message in rejected)
+        errors.sort(key=lambda error: error.index)
+        return BulkCreateDeliveryJobs(delivery_jobs=created, errors=errors)
+
+
+class DispatchAssignment(graphene.ObjectType):
+    job_id = graphene.ID()
+    vehicle_id = graphene.ID()
+
+
+class AutoDispatch(graphene.Mutation):
+    class Arguments:
+        start = graphene.DateTime(required=True, name='from')
+        end = graphene.DateTime(required=True, name='to')
+        batch_size = graphene.Int()
+
+    assigned_count = graphene.Int()
+    total_profit = graphene.Decimal()
+    assignments = graphene.List(DispatchAssignment)
+    unassigned_job_ids = graphene.List(graphene.ID)
+
+    @staticmethod
+    #@jwt_auth_required
+    def mutate(root, info, start, end, batch_size=None):
+        # Assigns every open, unassigned job with a slot starting in the window in one pass (see dispatch.solve)
+        result = dispatch.dispatch(start, end, batch_limit(batch_size))
+        return AutoDispatch(
+            assigned_count=len(result.assignments),
+            total_profit=result.profit,
+            assignments=[DispatchAssignment(job_id=job_id, vehicle_id=vehicle_id) for job_id, vehicle_id in result.assignments.items()],
+            unassigned_job_ids=result.unassigned_job_ids,
+        )
 
 
 class Mutation(graphene.ObjectType):
@@ -243,6 +739,19 @@ class Mutation(graphene.ObjectType):
     create_delivery_job = CreateDeliveryJob.Field()
     assign_vehicle_to_job = AssignVehicleToJob.Field()
     mark_delivery_jobs_as_completed = MarkDeliveryJobsAsCompleted.Field()
+    bulk_create_vehicles = BulkCreateVehicles.Field()
+    bulk_create_delivery_jobs = BulkCreateDeliveryJobs.Field()
+    auto_dispatch = AutoDispatch.Field()
+
+
+class Schema(graphene.Schema):
+    # Direct executions (tests, scripts, benchmarks) may omit the request context; see with_operation_root
+    def execute(self, *args, **kwargs):
+        return super().execute(*args, **with_operation_root(args, kwargs))
+
+    async def execute_async(self, *args, **kwargs):
+        return await super().execute_async(*args, **with_operation_root(args, kwargs))
 
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
\ No newline at end of file
+schema = Schema(query=Query, mutation=Mutation)
+async_schema = Schema(query=AsyncQuery, mutation=Mutation)
\ No newline at end of file
@@ -70,14 +70,52 @@ TEMPLATES = [
     },
 ]
 
+# Count and response caches; swap for a shared backend (e.g. Redis) when running several processes
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'logistics',
+    },
+}
+
 JWT_SECRET_KEY = 'testKey'
 JWT_ALGORITHM = 'HS256'
 JWT_EXPIRATION_SECONDS = 7200
+# Verified tokens kept in memory (until their exp) so each one is checked once
+JWT_TOKEN_CACHE_SIZE = 1024
+
+# Delivery slot length when a job gives no end, and the longest slot accepted; the cap bounds
+# how far back the overlap check has to look on the (vehicle, delivery_slot) index
+LOGISTICS_DEFAULT_SLOT_MINUTES = 60
+LOGISTICS_MAX_SLOT_MINUTES = 12 * 60
+# Rows per INSERT for bulk mutations and imports
+LOGISTICS_BULK_BATCH_SIZE = 500
+# Rows fetched per round trip when streaming exports
+LOGISTICS_EXPORT_CHUNK_SIZE = 2000
+# Seconds a totalCount result is reused for the same filters
+LOGISTICS_COUNT_CACHE_TTL = 30
+# Seconds a read query's response is reused; mutations bump the tags of the models they write
+LOGISTICS_RESPONSE_CACHE_TTL = 60
+# Parsed and validated GraphQL documents kept in memory per process
+LOGISTICS_DOCUMENT_CACHE_SIZE = 500
+# Query cost budget, nesting limit and the row cap for list fields requested without pagination
+LOGISTICS_QUERY_MAX_COST = 10000
+LOGISTICS_QUERY_MAX_DEPTH = 8
+LOGISTICS_MAX_LIST_SIZE = 1000
+# Receivers for per-resolver and per-operation timings; HistogramSink feeds /metrics/
+LOGISTICS_METRICS_SINKS = [
+    'Logistics.instrumentation.LogSink',
+    'Logistics.instrumentation.HistogramSink',
+]
+# Operation names come from clients: past this many series per kind, new names are folded into name="other"
+LOGISTICS_METRICS_MAX_SERIES = 200
 
 GRAPHENE = {
     'SCHEMA': 'Logistics.schema.schema',
     'MIDDLEWARE': [
-        'graphene_django.debug.DjangoDebugMiddleware',
+        'Logistics.instrumentation.InstrumentationMiddleware',
+        # Tracks every SQL statement per request; development only
+        *(['graphene_django.debug.DjangoDebugMiddleware'] if DEBUG else []),
     ],
     'DEFAULT_FIELD_NAME': '_',
     'DJANGO_CHOICE_FIELD_DESCRIPTION': True,
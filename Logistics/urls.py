@@ -1,8 +1,15 @@
 from django.urls import path
-from graphene_django.views import GraphQLView
 from .auth import login
+from .export import export_delivery_jobs
+from .instrumentation import metrics
+from .schema import async_schema
+from .views import AsyncGraphQLView, PersistedQueryGraphQLView
 
 urlpatterns = [
-    path('graphql/', GraphQLView.as_view(graphiql=True)),
-    path('login/', login, name='login')
+    path('graphql/', PersistedQueryGraphQLView.as_view(graphiql=True)),
+    # Same API for ASGI deployments; queries resolve with the async ORM
+    path('graphql/async/', AsyncGraphQLView.as_view(schema=async_schema, graphiql=True)),
+    path('login/', login, name='login'),
+    path('export/delivery-jobs/', export_delivery_jobs, name='export_delivery_jobs'),
+    path('metrics/', metrics, name='metrics'),
 ]
@@ -0,0 +1,296 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from inspect import isawaitable
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.utils.utils import set_rollback
+from graphene_django.views import GraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, execute, get_operation_ast, parse, validate, validate_schema
+from . import response_cache
+from .auth import authenticate_request
+from .complexity import default_validation_rules
+from .instrumentation import ameasure, measure, track_async_queries
+
+
+class DocumentCache:
+    # Thread-safe LRU of parsed, validated documents (with their response cache plan) keyed by the query's sha256
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            document = self._documents.get(key)
+            if document is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._documents.move_to_end(key)
+            return document
+
+    def set(self, key, document):
+        with self._lock:
+            self._documents[key] = document
+            self._documents.move_to_end(key)
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+            self.hits = self.misses = 0
+
+
+def persisted_query_error(message, code):
+    return ExecutionResult(errors=[GraphQLError(message, extensions={'code': code})])
+
+
+class PersistedQueryGraphQLView(GraphQLView):
+    # GraphQLView that speaks the Automatic Persisted Queries protocol and skips
+    # parse/validate for documents it has already seen
+    document_cache = DocumentCache(settings.LOGISTICS_DOCUMENT_CACHE_SIZE)
+    # Built once: the rule classes are part of the document cache key
+    validation_rules = default_validation_rules()
+
+    @staticmethod
+    def get_persisted_hash(request, data):
+        extensions = request.GET.get("extensions") or data.get("extensions")
+        if isinstance(extensions, str):
+            try:
+                extensions = json.loads(extensions)
+            except ValueError:
+                raise HttpError(HttpResponseBadRequest("Extensions are invalid JSON."))
+        persisted = (extensions or {}).get("persistedQuery") or {}
+        return persisted.get("sha256Hash")
+
+    def get_document(self, request, data, query):
+        # Returns ((document, response plan), None) or (None, ExecutionResult with errors)
+        persisted_hash = self.get_persisted_hash(request, data)
+        if query:
+            query_hash = hashlib.sha256(query.encode()).hexdigest()
+            if persisted_hash and persisted_hash != query_hash:
+                return None, persisted_query_error("provided sha does not match query", "INVALID_PERSISTED_QUERY")
+        elif persisted_hash:
+            query_hash = persisted_hash
+        else:
+            return None, None
+
+        key = (query_hash, tuple(self.validation_rules or ()))
+        entry = self.document_cache.get(key)
+        if entry is not None:
+            return entry, None
+        if not query:
+            return None, persisted_query_error("PersistedQueryNotFound", "PERSISTED_QUERY_NOT_FOUND")
+
+        try:
+            document = parse(query)
+        except Exception as e:
+            return None, ExecutionResult(errors=[e])
+        validation_errors = validate(
+            self.schema.graphql_schema,
+            document,
+            self.validation_rules,
+            graphene_settings.MAX_VALIDATION_ERRORS,
+        )
+        if validation_errors:
+            return None, ExecutionResult(data=None, errors=validation_errors)
+        entry = (document, response_cache.ResponsePlan(self.schema.graphql_schema, document))
+        self.document_cache.set(key, entry)
+        return entry, None
+
+    def get_context(self, request):
+        # Single auth pass: resolvers read request.user_id instead of decoding the token again
+        authenticate_request(request)
+        return request
+
+    def get_response(self, request, data, show_graphiql=False):
+        query, variables, operation_name, id = self.get_graphql_params(request, data)
+        execution_result = self.execute_graphql_request(
+            request, data, query, variables, operation_name, show_graphiql
+        )
+        return self.encode_result(request, execution_result, id, show_graphiql)
+
+    def encode_result(self, request, execution_result, id=None, show_graphiql=False):
+        # The second half of upstream get_response(), shared with the async view
+        if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+            set_rollback()
+
+        status_code = 200
+        if execution_result:
+            response = {}
+
+            if execution_result.errors:
+                set_rollback()
+                response["errors"] = [
+                    self.format_error(e) for e in execution_result.errors
+                ]
+
+            if execution_result.errors and any(
+                not getattr(e, "path", None) for e in execution_result.errors
+            ):
+                status_code = 400
+            else:
+                response["data"] = execution_result.data
+
+            if self.batch:
+                response["id"] = id
+                response["status"] = status_code
+
+            result = self.json_encode(request, response, pretty=show_graphiql)
+        else:
+            result = None
+
+        return result, status_code
+
+    def get_execute_options(self, request, variables, operation_name):
+        execute_options = {
+            "root_value": self.get_root_value(request),
+            "context_value": self.get_context(request),
+            "variable_values": variables,
+            "operation_name": operation_name,
+            "middleware": self.get_middleware(request),
+        }
+        if self.execution_context_class:
+            execute_options["execution_context_class"] = self.execution_context_class
+        return execute_options
+
+    def execute_graphql_request(
+        self, request, data, query, variables, operation_name, show_graphiql=False
+    ):
+        if not query and show_graphiql:
+            return None
+
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        entry, error_result = self.get_document(request, data, query)
+        if error_result is not None:
+            return error_result
+        if entry is None:
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        document, plan = entry
+        operation_ast = get_operation_ast(document, operation_name)
+        name = operation_ast.name.value if operation_ast is not None and operation_ast.name else 'anonymous'
+        if (
+            request.method.lower() == "get"
+            and operation_ast is not None
+            and operation_ast.operation != OperationType.QUERY
+        ):
+            if show_graphiql:
+                return None
+            raise HttpError(
+                HttpResponseNotAllowed(
+                    ["POST"],
+                    "Can only perform a {} operation from a POST request.".format(
+                        operation_ast.operation.value
+                    ),
+                )
+            )
+
+        try:
+            execute_options = self.get_execute_options(request, variables, operation_name)
+
+            if (
+                operation_ast is not None
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get("ATOMIC_MUTATIONS", False) is True
+                )
+            ):
+                with transaction.atomic(), measure('operation', name):
+                    result = execute(schema, document, **execute_options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+
+            with measure('operation', name):
+                if operation_ast is not None and operation_ast.operation == OperationType.QUERY:
+                    key, result = response_cache.get(plan, request, operation_name, variables)
+                    if result is None:
+                        result = execute(schema, document, **execute_options)
+                        response_cache.store(key, result)
+                    return result
+                return execute(schema, document, **execute_options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+
+
+class AsyncGraphQLView(PersistedQueryGraphQLView):
+    # ASGI view: queries execute on the event loop against the async schema, so a request waiting
+    # on the database does not hold a worker thread. Mutations, GraphiQL and batches keep the sync
+    # implementation (and its ATOMIC_MUTATIONS transaction), run on a worker thread.
+    view_is_async = True
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if request.method.lower() not in ("get", "post"):
+                raise HttpError(
+                    HttpResponseNotAllowed(
+                        ["GET", "POST"], "GraphQL only supports GET and POST requests."
+                    )
+                )
+
+            data = self.parse_body(request)
+            if self.batch or (self.graphiql and self.can_display_graphiql(request, data)):
+                return await sync_to_async(super().dispatch)(request, *args, **kwargs)
+
+            query, variables, operation_name, id = self.get_graphql_params(request, data)
+            execution_result = await self.aexecute_graphql_request(request, data, query, variables, operation_name)
+            result, status_code = self.encode_result(request, execution_result, id)
+            return HttpResponse(
+                status=status_code, content=result, content_type="application/json"
+            )
+
+        except HttpError as e:
+            response = e.response
+            response["Content-Type"] = "application/json"
+            response.content = self.json_encode(
+                request, {"errors": [self.format_error(e)]}
+            )
+            return response
+
+    async def aexecute_graphql_request(self, request, data, query, variables, operation_name):
+        schema = self.schema.graphql_schema
+        schema_validation_errors = validate_schema(schema)
+        if schema_validation_errors:
+            return ExecutionResult(data=None, errors=schema_validation_errors)
+
+        entry, error_result = self.get_document(request, data, query)
+        if error_result is not None:
+            return error_result
+        if entry is None:
+            raise HttpError(HttpResponseBadRequest("Must provide query string."))
+
+        document, plan = entry
+        operation_ast = get_operation_ast(document, operation_name)
+        if operation_ast is None or operation_ast.operation != OperationType.QUERY:
+            return await sync_to_async(self.execute_graphql_request)(
+                request, data, query, variables, operation_name
+            )
+
+        name = operation_ast.name.value if operation_ast.name else 'anonymous'
+        try:
+            await track_async_queries()
+            async with ameasure('operation', name):
+                key, result = await response_cache.aget(plan, request, operation_name, variables)
+                if result is None:
+                    result = execute(schema, document, **self.get_execute_options(request, variables, operation_name))
+                    if isawaitable(result):
+                        result = await result
+                    await response_cache.astore(key, result)
+                return result
+        except Exception as e:
+            return ExecutionResult(errors=[e])
@@ -0,0 +1,40 @@
+import re
+import pytest
+from django.core.cache import cache
+
+
+TRANSACTION_CONTROL = re.compile(r'^\s*(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO SAVEPOINT)\b', re.IGNORECASE)
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # The local-memory cache outlives each test's rolled-back transaction
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture
+def graphql_query_budget():
+    # Runs a GraphQL operation against the schema and fails the test, listing every statement,
+    # when it issues more SQL than budgeted. budget is an int or a callable receiving the
+    # response data, so it can grow with the size of the result. Savepoints only appear because
+    # tests run inside a transaction, so they are not counted.
+    from django.test import RequestFactory
+    from graphql import get_operation_ast, parse
+    from Logistics.instrumentation import count_queries
+    from Logistics.schema import schema as default_schema
+
+    def execute(document, budget, variables=None, schema=default_schema):
+        with count_queries(capture=True) as counter:
+            result = schema.execute(document, variable_values=variables, context_value=RequestFactory().post('/graphql/'))
+        assert not result.errors, result.errors
+        queries = [sql for sql in counter.queries if not TRANSACTION_CONTROL.match(sql)]
+        limit = budget(result.data) if callable(budget) else budget
+        if len(queries) > limit:
+            operation = get_operation_ast(parse(document))
+            fields = ', '.join(selection.name.value for selection in operation.selection_set.selections)
+            statements = '\n'.join(f'  {number}. {sql}' for number, sql in enumerate(queries, 1))
+            pytest.fail(f'{fields} ran {len(queries)} SQL queries, over its budget of {limit}:\n{statements}', pytrace=False)
+        return result.data
+    return execute
@@ -1,14 +1,34 @@
+import asyncio
 import datetime
+import hashlib
+import io
+import json
+import time
+from decimal import Decimal
+import graphene
+import jwt
 import pytest
 from graphene.test import Client
 import django
 
 django.setup()
 
-from Logistics.schema import schema
+from Logistics.schema import schema, filter_delivery_jobs, delivery_job_lookups, filter_vehicles, vehicle_lookups
+from Logistics.planner import plan, VEHICLE_INDEXES
+from Logistics.views import PersistedQueryGraphQLView
 from Logistics.models import Vehicle, DeliveryJob
-from Logistics.auth import generate_jwt_token
+from Logistics.auth import generate_jwt_token, token_cache
+from Logistics.decorators import jwt_auth_required
+from Logistics.instrumentation import HistogramSink, count_queries
+from Logistics import benchmark, dispatch, rollups, scheduling
+from Logistics.models import MonthlyFinancials
+from django.conf import settings
+from django.db import connection
+from django.db.models import F
 from django.contrib.auth.models import User
+from django.test import RequestFactory
+from django.core.management import CommandError, call_command
+from django.core.cache import cache
 
 
 @pytest.fixture
@@ -233,3 +253,1209 @@ def test_order_by_most_profitable_vehicle(graphql_client):
     assert delivery_jobs[1]['vehicle']['id'] == str(vehicle2.id)
     assert delivery_jobs[2]['vehicle']['id'] == str(vehicle1.id)
     assert delivery_jobs[3]['vehicle']['id'] == str(vehicle1.id)
+
+
+def _jobs_with_vehicles(count):
+    for i in range(count):
+        vehicle = Vehicle.objects.create(make=f'Make {i}', model=f'Model {i}', year=2022)
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=100, costs=10, vehicle=vehicle)
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_vehicle_query_count_is_constant(graphql_client):
+    query = '''
+        query {
+            allDeliveryJobs {
+                id
+                vehicle {
+                    id
+                    make
+                }
+            }
+        }
+    '''
+    _jobs_with_vehicles(3)
+    with count_queries() as small:
+        response = graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    assert 'errors' not in response
+    assert len(response['data']['allDeliveryJobs']) == 3
+
+    _jobs_with_vehicles(20)
+    with count_queries() as large:
+        response = graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    assert len(response['data']['allDeliveryJobs']) == 23
+    assert all(job['vehicle']['id'] for job in response['data']['allDeliveryJobs'])
+    assert large.count == small.count
+
+
+@pytest.mark.django_db
+def test_loaders_batch_without_a_request_context(graphql_client):
+    query = 'query { allDeliveryJobs { id vehicle { id make } } }'
+    _jobs_with_vehicles(3)
+    with count_queries() as with_context:
+        graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    _jobs_with_vehicles(20)
+    with count_queries() as without_context:
+        response = graphql_client.execute(query)
+    assert all(job['vehicle']['make'] for job in response['data']['allDeliveryJobs'])
+    assert without_context.count == with_context.count
+
+
+@pytest.mark.django_db
+def test_all_vehicles_delivery_jobs_are_batched(graphql_client):
+    query = '''
+        query {
+            allVehicles {
+                id
+                deliveryJobs {
+                    id
+                    vehicle {
+                        id
+                    }
+                }
+            }
+        }
+    '''
+    _jobs_with_vehicles(10)
+    with count_queries() as counter:
+        response = graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    vehicles = response['data']['allVehicles']
+    assert len(vehicles) == 10
+    assert all(v['deliveryJobs'][0]['vehicle']['id'] == v['id'] for v in vehicles)
+    assert counter.count == 2
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_selects_only_requested_columns(graphql_client):
+    _jobs_with_vehicles(5)
+    query = '''
+        query {
+            allDeliveryJobs {
+                id
+                destinationLocation
+            }
+        }
+    '''
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    assert len(response['data']['allDeliveryJobs']) == 5
+    assert counter.count == 1
+    assert '"income"' not in counter.queries[0]
+    assert 'JOIN' not in counter.queries[0]
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_joins_vehicle_when_selected(graphql_client):
+    _jobs_with_vehicles(5)
+    query = '''
+        query {
+            allDeliveryJobs {
+                id
+                ...jobVehicle
+            }
+        }
+        fragment jobVehicle on DeliveryJobType {
+            vehicle {
+                make
+            }
+        }
+    '''
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    jobs = response['data']['allDeliveryJobs']
+    assert [job['vehicle']['make'] for job in jobs] == [f'Make {i}' for i in range(5)]
+    assert counter.count == 1
+    assert 'JOIN' in counter.queries[0]
+    assert '"model"' not in counter.queries[0]
+
+
+CONNECTION_QUERY = '''
+    query Jobs($first: Int, $after: String, $profit: Boolean) {
+        allDeliveryJobsConnection(first: $first, after: $after, orderByMostProfitableVehicle: $profit) {
+            edges {
+                cursor
+                node {
+                    id
+                    income
+                    costs
+                }
+            }
+            pageInfo {
+                hasNextPage
+                endCursor
+            }
+        }
+    }
+'''
+
+
+def _walk_connection(graphql_client, first, profit=False):
+    ids, after, pages = [], None, 0
+    while True:
+        response = graphql_client.execute(CONNECTION_QUERY, variables={'first': first, 'after': after, 'profit': profit})
+        assert 'errors' not in response
+        connection = response['data']['allDeliveryJobsConnection']
+        ids.extend(int(edge['node']['id']) for edge in connection['edges'])
+        pages += 1
+        if not connection['pageInfo']['hasNextPage']:
+            return ids, pages
+        after = connection['pageInfo']['endCursor']
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_connection_walks_every_row_once(graphql_client):
+    for i in range(25):
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=100 + (i % 4), costs=10)
+    ids, pages = _walk_connection(graphql_client, 10)
+    assert ids == sorted(DeliveryJob.objects.values_list('id', flat=True))
+    assert pages == 3
+
+    ids, _ = _walk_connection(graphql_client, 7, profit=True)
+    expected = DeliveryJob.objects.annotate(p=F('income') - F('costs')).order_by('-p', '-id').values_list('id', flat=True)
+    assert ids == list(expected)
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_connection_seeks_without_offset(graphql_client):
+    for i in range(30):
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=100, costs=10)
+    first_page = graphql_client.execute(CONNECTION_QUERY, variables={'first': 10})
+    after = first_page['data']['allDeliveryJobsConnection']['pageInfo']['endCursor']
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute(CONNECTION_QUERY, variables={'first': 10, 'after': after})
+    assert len(response['data']['allDeliveryJobsConnection']['edges']) == 10
+    assert counter.count == 1
+    assert 'OFFSET' not in counter.queries[0]
+    assert 'COUNT' not in counter.queries[0]
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_connection_enforces_limits(graphql_client):
+    response = graphql_client.execute(CONNECTION_QUERY, variables={'first': 101})
+    assert 'exceeds the `first` limit of 100' in response['errors'][0]['message']
+    response = graphql_client.execute(CONNECTION_QUERY)
+    assert 'must provide a `first` value' in response['errors'][0]['message']
+    response = graphql_client.execute(CONNECTION_QUERY, variables={'first': 10, 'after': 'bogus'})
+    assert 'Invalid cursor' in response['errors'][0]['message']
+
+
+@pytest.mark.django_db
+def test_profit_column_is_maintained_on_every_write_path():
+    job = DeliveryJob.objects.create(destination_location='Location', income=100.5, costs=20.25)
+    assert job.profit == Decimal('80.25')
+
+    DeliveryJob.objects.filter(pk=job.pk).update(income=Decimal('150'))
+    job.refresh_from_db()
+    assert job.profit == Decimal('129.75')
+
+    DeliveryJob.objects.filter(pk=job.pk).update(income=200, costs=50)
+    job.refresh_from_db()
+    assert job.profit == Decimal('150')
+
+    DeliveryJob.objects.filter(pk=job.pk).update(income=F('income') + 10, costs=40)
+    job.refresh_from_db()
+    assert job.profit == Decimal('170')
+
+    DeliveryJob.objects.filter(pk=job.pk).update(income=Decimal('150'), costs=Decimal('20.25'))
+    job.refresh_from_db()
+
+    job.costs = Decimal('50')
+    job.save(update_fields=['costs'])
+    job.refresh_from_db()
+    assert job.profit == Decimal('100')
+
+    jobs = DeliveryJob.objects.bulk_create([DeliveryJob(destination_location='Bulk', income=10, costs=3)])
+    assert DeliveryJob.objects.get(pk=jobs[0].pk).profit == Decimal('7')
+
+    jobs[0].income = Decimal('30')
+    DeliveryJob.objects.bulk_update(jobs, ['income'])
+    assert DeliveryJob.objects.get(pk=jobs[0].pk).profit == Decimal('27')
+
+
+@pytest.mark.django_db
+def test_profit_ordering_and_range_use_index(graphql_client):
+    for i in range(5):
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=100 + i, costs=10)
+    response = graphql_client.execute('''
+        query {
+            allDeliveryJobs(orderByMostProfitableVehicle: true, minProfit: "91", maxProfit: "93") {
+                profit
+            }
+        }
+    ''')
+    assert [job['profit'] for job in response['data']['allDeliveryJobs']] == ['93.00', '92.00', '91.00']
+    plan = DeliveryJob.objects.filter(profit__gte=91).order_by('-profit', '-id').explain()
+    assert 'deliveryjob_profit_id_idx' in plan
+    assert 'TEMP B-TREE' not in plan
+
+
+def _job_in(year, month, income, costs, vehicle=None):
+    slot = datetime.datetime(year, month, 15, 12, tzinfo=datetime.timezone.utc)
+    job = DeliveryJob.objects.create(destination_location='Location', delivery_slot=slot, income=income, costs=costs, vehicle=vehicle)
+    rollups.record_created([job])
+    return job
+
+
+@pytest.mark.django_db
+def test_calculate_monthly_income_costs_is_scoped_to_year(graphql_client):
+    _job_in(2025, 3, 100, 40)
+    _job_in(2025, 3, 50, 10)
+    _job_in(2024, 3, 1000, 400)
+    _job_in(2025, 4, 7, 1)
+    query = '''
+        query {
+            calculateMonthlyIncomeCosts(month: 3, year: 2025) {
+                year
+                month
+                totalIncome
+                totalCosts
+            }
+        }
+    '''
+    with count_queries() as counter:
+        response = graphql_client.execute(query)
+    assert response['data']['calculateMonthlyIncomeCosts'] == {'year': 2025, 'month': 3, 'totalIncome': 150.0, 'totalCosts': 50.0}
+    assert counter.count == 1
+
+
+@pytest.mark.django_db
+def test_calculate_yearly_income_costs_uses_one_query(graphql_client):
+    _job_in(2025, 1, 100, 40)
+    _job_in(2025, 12, 50, 10)
+    _job_in(2026, 1, 1000, 400)
+    query = '''
+        query {
+            calculateYearlyIncomeCosts(year: 2025) {
+                month
+                totalIncome
+                totalCosts
+            }
+        }
+    '''
+    with count_queries() as counter:
+        response = graphql_client.execute(query)
+    months = response['data']['calculateYearlyIncomeCosts']
+    assert counter.count == 1
+    assert [m['month'] for m in months] == list(range(1, 13))
+    assert months[0] == {'month': 1, 'totalIncome': 100.0, 'totalCosts': 40.0}
+    assert months[11] == {'month': 12, 'totalIncome': 50.0, 'totalCosts': 10.0}
+    assert sum(m['totalIncome'] for m in months) == 150.0
+
+
+def _rollup_snapshot():
+    return sorted(
+        MonthlyFinancials.objects.values_list('year', 'month', 'vehicle_id', 'income', 'costs', 'job_count', 'completed_count'),
+        key=repr,
+    )
+
+
+@pytest.mark.django_db
+def test_mutations_keep_financial_rollup_in_sync(graphql_client):
+    vehicle1 = Vehicle.objects.create(make='Make 1', model='Model 1', year=2022)
+    vehicle2 = Vehicle.objects.create(make='Make 2', model='Model 2', year=2022)
+    create = '''
+        mutation Create($slot: DateTime!, $vehicleId: ID!) {
+            createDeliveryJob(destinationLocation: "Somewhere", deliverySlot: $slot, income: "120.50", costs: "20.25", vehicleId: $vehicleId) {
+                deliveryJob { id }
+            }
+        }
+    '''
+    job_ids = []
+    for slot, vehicle in [('2025-03-02T10:00:00+00:00', vehicle1), ('2025-03-20T10:00:00+00:00', vehicle1), ('2025-04-01T10:00:00+00:00', vehicle2)]:
+        response = graphql_client.execute(create, variables={'slot': slot, 'vehicleId': str(vehicle.id)})
+        job_ids.append(int(response['data']['createDeliveryJob']['deliveryJob']['id']))
+
+    graphql_client.execute('''
+        mutation { markDeliveryJobsAsCompleted(jobIds: [%d, %d]) { success } }
+    ''' % (job_ids[0], job_ids[2]))
+    graphql_client.execute('''
+        mutation { assignVehicleToJob(jobId: "%d", vehicleId: "%d") { deliveryJob { id } } }
+    ''' % (job_ids[0], vehicle2.id))
+
+    incremental = _rollup_snapshot()
+    rollups.rebuild()
+    assert incremental == _rollup_snapshot()
+
+    response = graphql_client.execute('''
+        query { calculateMonthlyIncomeCosts(month: 3, year: 2025) { totalIncome totalCosts jobCount completedCount } }
+    ''')
+    assert response['data']['calculateMonthlyIncomeCosts'] == {
+        'totalIncome': 241.0, 'totalCosts': 40.5, 'jobCount': 2, 'completedCount': 1,
+    }
+
+
+@pytest.mark.django_db
+def test_bulk_create_vehicles_reports_invalid_items(graphql_client):
+    mutation = '''
+        mutation Bulk($vehicles: [VehicleInput!]!) {
+            bulkCreateVehicles(vehicles: $vehicles, batchSize: 2) {
+                vehicles { id make isActive }
+                errors { index message }
+            }
+        }
+    '''
+    vehicles = [{'make': f'Make {i}', 'model': 'Model', 'year': 2020} for i in range(5)]
+    vehicles[3]['make'] = 'x' * 30
+    vehicles[4]['isActive'] = False
+    response = graphql_client.execute(mutation, variables={'vehicles': vehicles})
+    result = response['data']['bulkCreateVehicles']
+    assert [v['make'] for v in result['vehicles']] == ['Make 0', 'Make 1', 'Make 2', 'Make 4']
+    assert result['vehicles'][3]['isActive'] is False
+    assert [e['index'] for e in result['errors']] == [3]
+    assert 'make' in result['errors'][0]['message']
+    assert Vehicle.objects.count() == 4
+
+
+@pytest.mark.django_db
+def test_bulk_create_delivery_jobs_validates_vehicles_in_one_lookup(graphql_client):
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    mutation = '''
+        mutation Bulk($jobs: [DeliveryJobInput!]!) {
+            bulkCreateDeliveryJobs(deliveryJobs: $jobs, batchSize: 10) {
+                deliveryJobs { id profit vehicle { id } }
+                errors { index message }
+            }
+        }
+    '''
+
+    def jobs(count, day):
+        # One vehicle, back-to-back hour slots, so that nothing double-books it
+        return [
+            {'destinationLocation': f'Location {i}', 'deliverySlot': f'2025-05-{day + i // 24:02d}T{i % 24:02d}:00:00+00:00', 'income': '100', 'costs': '30', 'vehicleId': str(vehicle.id)}
+            for i in range(count)
+        ]
+
+    batch = jobs(13, 1)
+    batch[5]['vehicleId'] = '999999'
+    batch[6]['vehicleId'] = 'abc'
+    batch[7]['income'] = '1.234'
+    with count_queries() as small:
+        response = graphql_client.execute(mutation, variables={'jobs': batch}, context_value=RequestFactory().post('/graphql/'))
+    result = response['data']['bulkCreateDeliveryJobs']
+    assert len(result['deliveryJobs']) == 10
+    assert all(job['vehicle']['id'] == str(vehicle.id) and job['profit'] == '70.00' for job in result['deliveryJobs'])
+    assert [e['index'] for e in result['errors']] == [5, 6, 7]
+
+    with count_queries() as large:
+        response = graphql_client.execute(mutation, variables={'jobs': jobs(50, 10)}, context_value=RequestFactory().post('/graphql/'))
+    assert len(response['data']['bulkCreateDeliveryJobs']['deliveryJobs']) == 50
+    # Only the extra chunks cost queries, one INSERT and one overlap read each; vehicle checks
+    # and rollup writes do not grow with the batch
+    assert large.count <= small.count + 2 * 3 + 1
+    assert DeliveryJob.objects.count() == 60
+    assert rollups.monthly_totals(2025, 5).job_count == 60
+
+
+@pytest.mark.django_db
+def test_import_delivery_jobs_streams_csv_and_resumes(tmp_path):
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    path = tmp_path / 'jobs.csv'
+    rows = ['destination_location,delivery_slot,income,costs,vehicle_id']
+    rows += [f'"Dock {i}, Bay 2",2025-06-0{1 + i % 3}T{8 + i}:00:00+00:00,100.00,40.00,{vehicle.id}' for i in range(6)]
+    rows.insert(4, 'Broken,not-a-date,1,1,')
+    rows.insert(5, f'Ghost,2025-06-01T08:00:00,1,1,{vehicle.id + 100}')
+    path.write_text('\n'.join(rows) + '\n')
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command('import_delivery_jobs', str(path), batch_size=4, stdout=stdout, stderr=stderr)
+    assert DeliveryJob.objects.count() == 6
+    assert DeliveryJob.objects.filter(destination_location='Dock 0, Bay 2', vehicle=vehicle, profit=60).exists()
+    assert 'Imported 6 delivery jobs (2 skipped)' in stdout.getvalue()
+    assert 'rows/s' in stderr.getvalue()
+    assert rollups.monthly_totals(2025, 6).job_count == 6
+
+    # Resuming from the offset of the last committed chunk imports nothing twice
+    offset = int(stdout.getvalue().rsplit('last offset ', 1)[1])
+    call_command('import_delivery_jobs', str(path), offset=offset, stdout=io.StringIO(), stderr=io.StringIO())
+    assert DeliveryJob.objects.count() == 6
+
+
+@pytest.mark.django_db
+def test_bulk_writes_do_not_double_book_vehicles(graphql_client, tmp_path):
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    other = Vehicle.objects.create(make='Make', model='Other', year=2022)
+    booked = DeliveryJob.objects.create(
+        destination_location='Booked', delivery_slot=datetime.datetime(2025, 5, 1, 10, tzinfo=datetime.timezone.utc), income=1, costs=1, vehicle=vehicle,
+    )
+    mutation = '''
+        mutation Bulk($jobs: [DeliveryJobInput!]!) {
+            bulkCreateDeliveryJobs(deliveryJobs: $jobs, batchSize: 2) {
+                deliveryJobs { destinationLocation slotEnd }
+                errors { index message }
+            }
+        }
+    '''
+
+    def job(name, slot, slot_end=None, vehicle_id=vehicle.id):
+        return {'destinationLocation': name, 'deliverySlot': slot, 'slotEnd': slot_end, 'income': '10', 'costs': '1', 'vehicleId': str(vehicle_id)}
+
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute(mutation, variables={'jobs': [
+            job('Overlaps stored', '2025-05-01T10:30:00+00:00'),
+            job('Free', '2025-05-01T11:00:00+00:00', '2025-05-01T12:30:00+00:00'),
+            job('Overlaps item 1', '2025-05-01T12:00:00+00:00'),
+            job('Other vehicle', '2025-05-01T10:00:00+00:00', vehicle_id=other.id),
+            job('Backwards', '2025-05-01T15:00:00+00:00', '2025-05-01T14:00:00+00:00'),
+            job('After', '2025-05-01T12:30:00+00:00'),
+        ]}, context_value=RequestFactory().post('/graphql/'))
+    result = response['data']['bulkCreateDeliveryJobs']
+    assert [j['destinationLocation'] for j in result['deliveryJobs']] == ['Free', 'Other vehicle', 'After']
+    assert result['deliveryJobs'][0]['slotEnd'] == '2025-05-01T12:30:00+00:00'
+    assert [e['index'] for e in result['errors']] == [0, 2, 4]
+    assert f'by delivery job {booked.id}' in result['errors'][0]['message']
+    # The second chunk sees the first chunk's inserts as bookings
+    assert f'by delivery job {DeliveryJob.objects.get(destination_location="Free").id}' in result['errors'][1]['message']
+    assert 'after its start' in result['errors'][2]['message']
+    # One overlap read per chunk, not per item
+    assert len([sql for sql in counter.queries if sql.startswith('SELECT') and '"slot_end" >' in sql]) == 3
+
+    path = tmp_path / 'jobs.ndjson'
+    path.write_text('\n'.join(json.dumps(row) for row in [
+        {'destination_location': 'Import overlaps stored', 'delivery_slot': '2025-05-01T09:30:00Z', 'income': 1, 'costs': 1, 'vehicle_id': vehicle.id},
+        {'destination_location': 'Import free', 'delivery_slot': '2025-05-02T08:00:00Z', 'slot_end': '2025-05-02T09:00:00Z', 'income': 1, 'costs': 1, 'vehicle_id': vehicle.id},
+        {'destination_location': 'Import overlaps row', 'delivery_slot': '2025-05-02T08:30:00Z', 'income': 1, 'costs': 1, 'vehicle_id': vehicle.id},
+    ]) + '\n')
+    stdout, stderr = io.StringIO(), io.StringIO()
+    call_command('import_delivery_jobs', str(path), stdout=stdout, stderr=stderr)
+    assert 'Imported 1 delivery jobs (2 skipped)' in stdout.getvalue()
+    assert 'already booked' in stderr.getvalue() and 'an earlier job of the same batch' in stderr.getvalue()
+    assert DeliveryJob.objects.filter(destination_location__startswith='Import').count() == 1
+
+
+@pytest.mark.django_db
+def test_import_delivery_jobs_streams_ndjson(tmp_path):
+    path = tmp_path / 'jobs.ndjson'
+    lines = [
+        json.dumps({'destination_location': f'Stop {i}', 'delivery_slot': '2025-07-01T08:00:00Z', 'income': 10, 'costs': 4})
+        for i in range(5)
+    ]
+    lines.insert(2, '{not json')
+    path.write_text('\n'.join(lines) + '\n')
+    call_command('import_delivery_jobs', str(path), stdout=io.StringIO(), stderr=io.StringIO())
+    assert DeliveryJob.objects.count() == 5
+    assert set(DeliveryJob.objects.values_list('profit', flat=True)) == {Decimal('6')}
+
+
+@pytest.mark.django_db
+def test_export_delivery_jobs_streams_filtered_rows(client):
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    for i in range(5):
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=100 + i, costs=10, vehicle=vehicle if i % 2 else None)
+
+    response = client.get('/export/delivery-jobs/', {'vehicle_id': vehicle.id})
+    assert response.streaming
+    lines = b''.join(response.streaming_content).decode().splitlines()
+    assert lines[0].startswith('id,created_at')
+    assert [line.split(',')[3] for line in lines[1:]] == ['Location 1', 'Location 3']
+
+    response = client.get('/export/delivery-jobs/', {'format': 'ndjson', 'min_profit': '93', 'orderByMostProfitableVehicle': 'true'})
+    rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+    assert [row['profit'] for row in rows] == ['94.00', '93.00']
+
+    assert client.get('/export/delivery-jobs/', {'income': 'lots'}).status_code == 400
+    assert client.get('/export/delivery-jobs/', {'vehicle_id': 'abc'}).status_code == 400
+    assert client.get('/export/delivery-jobs/', {'income': 'NaN'}).status_code == 400
+    assert client.get('/export/delivery-jobs/', {'min_income': 'Infinity'}).status_code == 400
+    assert client.get('/export/delivery-jobs/', {'completed': 'maybe'}).status_code == 400
+    response = client.get('/export/delivery-jobs/', {'completed': 'no'})
+    assert len(b''.join(response.streaming_content).decode().splitlines()) == 6
+    assert client.get('/export/delivery-jobs/', {'vehicle_ids': f'{vehicle.id},abc'}).status_code == 400
+    response = client.get('/export/delivery-jobs/', {'vehicle_ids': f'{vehicle.id},999999'})
+    assert len(b''.join(response.streaming_content).decode().splitlines()) == 3
+    assert client.get('/export/delivery-jobs/', {'format': 'xml'}).status_code == 400
+
+
+@pytest.mark.django_db
+def test_total_count_is_cached_until_a_write(graphql_client):
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    for i in range(3):
+        DeliveryJob.objects.create(destination_location='Depot', income=100, costs=10, vehicle=vehicle)
+    query = '''
+        query Count($destination_location: String, $page: Int) {
+            totalCount
+            allDeliveryJobs(destinationLocation: $destination_location, page: $page) { id }
+        }
+    '''
+    response = graphql_client.execute(query, variables={'destination_location': 'Depot', 'page': 1})
+    assert response['data']['totalCount'] == 3
+
+    # Another page of the same listing reuses the cached count; only the Paginator still counts
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute(query, variables={'destination_location': 'Depot', 'page': 2})
+    assert response['data']['totalCount'] == 3
+    assert sum('COUNT' in sql for sql in counter.queries) == 1
+
+    graphql_client.execute('''
+        mutation Create($vehicleId: ID!) {
+            createDeliveryJob(destinationLocation: "Depot", deliverySlot: "2025-01-01T00:00:00Z", income: "1", costs: "1", vehicleId: $vehicleId) {
+                deliveryJob { id }
+            }
+        }
+    ''', variables={'vehicleId': str(vehicle.id)})
+    response = graphql_client.execute(query, variables={'destination_location': 'Depot', 'page': 1})
+    assert response['data']['totalCount'] == 4
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('arguments, index', [
+    ({'destination_location': 'Depot'}, 'deliveryjob_dest_slot_idx'),
+    ({'destination_location': 'Depot', 'delivery_slot': '2025-01-01T08:00:00+00:00'}, 'deliveryjob_dest_slot_idx'),
+    ({'vehicle_id': '1'}, 'deliveryjob_vehicle_slot_idx'),
+    ({'vehicle_id': '1', 'delivery_slot': '2025-01-01T08:00:00+00:00', 'income': '10'}, 'deliveryjob_vehicle_slot_idx'),
+    ({'delivery_slot': '2025-01-01T08:00:00+00:00', 'costs': '5'}, 'deliveryjob_slot_idx'),
+    ({'min_profit': '10', 'orderByMostProfitableVehicle': True}, 'deliveryjob_profit_id_idx'),
+    ({'vehicle_ids': ['1', '2'], 'delivery_slot_from': '2025-01-01T00:00:00+00:00', 'delivery_slot_to': '2025-02-01T00:00:00+00:00'}, 'deliveryjob_vehicle_slot_idx'),
+    ({'destinations': ['Depot', 'Port'], 'min_income': '10', 'max_costs': '5'}, 'deliveryjob_dest_slot_idx'),
+    ({'delivery_slot_from': '2025-01-01T00:00:00+00:00', 'delivery_slot_to': '2025-01-02T00:00:00+00:00', 'min_income': '10'}, 'deliveryjob_slot_idx'),
+    ({'completed': False}, 'deliveryjob_completed_at_idx'),
+])
+def test_filter_delivery_jobs_avoids_full_scans(arguments, index):
+    queryset, _ = filter_delivery_jobs(**arguments)
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        detail = ' '.join(row[-1] for row in cursor.fetchall())
+    assert 'SCAN Logistics_deliveryjob' not in detail, detail
+    assert index in detail, detail
+    assert plan(delivery_job_lookups(**arguments))[0] == index
+
+
+def test_planner_orders_predicates_by_index_columns():
+    name, predicates = plan({'income': 10, 'delivery_slot__gte': 'x', 'vehicle_id': 1})
+    assert name == 'deliveryjob_vehicle_slot_idx'
+    assert [lookup for lookup, _ in predicates] == ['vehicle_id', 'delivery_slot__gte', 'income']
+
+
+@pytest.mark.django_db
+def test_all_delivery_jobs_range_and_set_filters(graphql_client):
+    vehicle1 = Vehicle.objects.create(make='Make 1', model='Model', year=2022)
+    vehicle2 = Vehicle.objects.create(make='Make 2', model='Model', year=2022)
+    vehicle3 = Vehicle.objects.create(make='Make 3', model='Model', year=2022)
+    for day, vehicle, destination, income, costs in [
+        (1, vehicle1, 'Depot', 100, 10),
+        (2, vehicle2, 'Port', 200, 20),
+        (3, vehicle3, 'Depot', 300, 30),
+        (4, vehicle1, 'Airport', 400, 40),
+        (5, vehicle2, 'Depot', 50, 60),
+    ]:
+        slot = datetime.datetime(2025, 3, day, 9, tzinfo=datetime.timezone.utc)
+        DeliveryJob.objects.create(destination_location=destination, delivery_slot=slot, income=income, costs=costs, vehicle=vehicle)
+    DeliveryJob.objects.filter(income=400).update(completed_at=datetime.datetime(2025, 3, 4, 12, tzinfo=datetime.timezone.utc))
+
+    query = '''
+        query Jobs($from: DateTime, $to: DateTime, $minIncome: Decimal, $maxCosts: Decimal, $vehicleIds: [ID!], $destinations: [String!], $completed: Boolean) {
+            allDeliveryJobs(deliverySlotFrom: $from, deliverySlotTo: $to, minIncome: $minIncome, maxCosts: $maxCosts,
+                            vehicleIds: $vehicleIds, destinations: $destinations, completed: $completed) {
+                income
+            }
+        }
+    '''
+
+    def incomes(**variables):
+        response = graphql_client.execute(query, variables=variables)
+        assert 'errors' not in response, response
+        return [float(job['income']) for job in response['data']['allDeliveryJobs']]
+
+    assert incomes(**{'from': '2025-03-02T00:00:00+00:00', 'to': '2025-03-04T09:00:00+00:00'}) == [200, 300]
+    assert incomes(minIncome='150', maxCosts='35') == [200, 300]
+    assert incomes(vehicleIds=[str(vehicle1.id), str(vehicle3.id)]) == [100, 300, 400]
+    assert incomes(destinations=['Port', 'Airport']) == [200, 400]
+    assert incomes(completed=True) == [400]
+    assert incomes(completed=False, destinations=['Depot']) == [100, 300, 50]
+    assert incomes(vehicleIds=[]) == []
+
+
+def _post_graphql(client, body):
+    return client.post('/graphql/', json.dumps(body), content_type='application/json').json()
+
+
+@pytest.mark.django_db
+def test_graphql_view_supports_persisted_queries(client):
+    Vehicle.objects.create(make='Make', model='Model', year=2022)
+    PersistedQueryGraphQLView.document_cache.clear()
+    query = '{ allVehicles { make } }'
+    extensions = {'persistedQuery': {'version': 1, 'sha256Hash': hashlib.sha256(query.encode()).hexdigest()}}
+
+    response = _post_graphql(client, {'extensions': extensions})
+    assert response['errors'][0]['message'] == 'PersistedQueryNotFound'
+    assert response['errors'][0]['extensions']['code'] == 'PERSISTED_QUERY_NOT_FOUND'
+
+    response = _post_graphql(client, {'query': query, 'extensions': extensions})
+    assert response['data'] == {'allVehicles': [{'make': 'Make'}]}
+
+    response = _post_graphql(client, {'extensions': extensions})
+    assert response['data'] == {'allVehicles': [{'make': 'Make'}]}
+
+    response = client.get('/graphql/', {'extensions': json.dumps(extensions)}, HTTP_ACCEPT='application/json').json()
+    assert response['data'] == {'allVehicles': [{'make': 'Make'}]}
+
+    wrong = {'persistedQuery': {'version': 1, 'sha256Hash': '0' * 64}}
+    response = _post_graphql(client, {'query': query, 'extensions': wrong})
+    assert response['errors'][0]['extensions']['code'] == 'INVALID_PERSISTED_QUERY'
+
+
+@pytest.mark.django_db
+def test_graphql_view_caches_parsed_documents(client):
+    PersistedQueryGraphQLView.document_cache.clear()
+    query = '{ allVehicles { id } }'
+    for _ in range(3):
+        assert _post_graphql(client, {'query': query})['data'] == {'allVehicles': []}
+    assert PersistedQueryGraphQLView.document_cache.misses == 1
+    assert PersistedQueryGraphQLView.document_cache.hits == 2
+
+    response = _post_graphql(client, {'query': '{ allVehicles { nope } }'})
+    assert 'nope' in response['errors'][0]['message']
+
+
+@pytest.mark.django_db
+def test_graphql_operations_are_exported_as_metrics(client):
+    Vehicle.objects.create(make='Make', model='Model', year=2022)
+    response = _post_graphql(client, {'query': 'query FleetPicker { allVehicles { id } totalCount }', 'operationName': 'FleetPicker'})
+    assert 'errors' not in response
+
+    body = client.get('/metrics/').content.decode()
+    assert 'logistics_graphql_duration_seconds_count{kind="operation",name="FleetPicker"}' in body
+    assert 'logistics_graphql_duration_seconds_count{kind="resolver",name="Query.allVehicles"}' in body
+    queries = [line for line in body.splitlines() if line.startswith('logistics_graphql_sql_queries_total{kind="resolver",name="Query.allVehicles"}')]
+    assert int(queries[0].rsplit(' ', 1)[1]) >= 1
+
+
+@pytest.mark.django_db
+def test_graphql_view_rejects_expensive_and_deep_queries(client):
+    response = _post_graphql(client, {'query': '{ allVehicles { deliveryJobs { vehicle { deliveryJobs { id } } } } }'})
+    assert 'exceeds the maximum' in response['errors'][0]['message']
+
+    # Unbounded nested lists are charged at LOGISTICS_MAX_LIST_SIZE per parent row
+    response = _post_graphql(client, {'query': '{ allVehicles(page: 1, pageSize: 20) { deliveryJobs { id } } }'})
+    assert 'Query cost 20020 exceeds' in response['errors'][0]['message']
+    response = _post_graphql(client, {'query': '{ totalCount allVehicles(page: 1, pageSize: 5) { deliveryJobs { id } } }'})
+    assert 'errors' not in response
+
+    nested = 'vehicle { deliveryJobs { ' * 4 + 'id' + ' } }' * 4
+    response = _post_graphql(client, {'query': '{ allDeliveryJobsConnection(first: 1) { edges { node { %s } } } }' % nested})
+    assert 'exceeds maximum operation depth' in response['errors'][0]['message']
+
+    response = _post_graphql(client, {'query': 'query($n: Int) { allDeliveryJobs(numRows: $n) { id } }', 'variables': {'n': 5}})
+    assert 'errors' not in response
+
+    # Sizes below 1 and page sizes without a page are charged at the cap, so they cannot lower the total
+    negative = '{ a: allDeliveryJobs(numRows: -100000000) { id } b: allVehicles(page: 1, pageSize: 9) { deliveryJobs { id } } }'
+    assert 'exceeds the maximum' in _post_graphql(client, {'query': negative})['errors'][0]['message']
+    response = _post_graphql(client, {'query': '{ allVehicles(pageSize: 5) { deliveryJobs { id } } }'})
+    assert 'Query cost 1001000 exceeds' in response['errors'][0]['message']
+    paged = 'query($page: %s) { allVehicles(page: $page, pageSize: 5) { deliveryJobs { id } } }'
+    assert 'errors' not in _post_graphql(client, {'query': paged % 'Int!', 'variables': {'page': 1}})
+    assert 'exceeds the maximum' in _post_graphql(client, {'query': paged % 'Int', 'variables': {'page': 1}})['errors'][0]['message']
+
+
+@pytest.mark.django_db
+def test_unpaginated_lists_are_capped(graphql_client, settings):
+    settings.LOGISTICS_MAX_LIST_SIZE = 3
+    for i in range(5):
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=10, costs=1)
+    response = graphql_client.execute('{ allDeliveryJobs { id } }')
+    assert len(response['data']['allDeliveryJobs']) == 3
+    response = graphql_client.execute('{ allDeliveryJobs(numRows: 2) { id } }')
+    assert len(response['data']['allDeliveryJobs']) == 2
+    response = graphql_client.execute('{ allDeliveryJobs(page: 1, pageSize: 5) { id } }')
+    assert len(response['data']['allDeliveryJobs']) == 3
+    for num_rows in (0, -1):
+        response = graphql_client.execute('query($n: Int) { allDeliveryJobs(numRows: $n) { id } }', variables={'n': num_rows})
+        assert response['errors'][0]['message'] == '`numRows` must be at least 1.'
+
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    DeliveryJob.objects.update(vehicle=vehicle)
+    response = graphql_client.execute('{ allVehicles { deliveryJobs { id } } }')
+    assert len(response['data']['allVehicles'][0]['deliveryJobs']) == 3
+
+
+@pytest.mark.django_db
+def test_page_sizes_are_capped(client, settings):
+    # Page sizes are charged at the cap when given as variables, so the resolvers must apply it too
+    settings.LOGISTICS_MAX_LIST_SIZE = 3
+    for i in range(5):
+        Vehicle.objects.create(make='Make', model=f'Model {i}', year=2022)
+        DeliveryJob.objects.create(destination_location=f'Location {i}', income=10, costs=1)
+    queries = {
+        'allDeliveryJobs': 'query($p: Int!, $s: Int!) { allDeliveryJobs(page: $p, pageSize: $s) { id } }',
+        'allVehicles': 'query($p: Int!, $s: Int!) { allVehicles(page: $p, pageSize: $s) { id } }',
+    }
+    for path in ('/graphql/', '/graphql/async/'):
+        for field, query in queries.items():
+            body = {'query': query, 'variables': {'p': 1, 's': 200}}
+            response = client.post(path, json.dumps(body), content_type='application/json').json()
+            assert len(response['data'][field]) == 3
+            body['variables']['s'] = -1
+            response = client.post(path, json.dumps(body), content_type='application/json').json()
+            assert response['errors'][0]['message'] == '`pageSize` must be at least 1.'
+
+
+ASYNC_DASHBOARD_QUERY = '''
+    query Dashboard {
+        totalCount
+        calculateMonthlyIncomeCosts(month: 1, year: 2023) { totalIncome jobCount }
+        allVehicles(page: 1, pageSize: 4) { id make deliveryJobs { id income vehicle { id } } }
+        allDeliveryJobs(numRows: 10, completed: false) { id profit vehicle { id make } }
+        allDeliveryJobsConnection(first: 2, orderByMostProfitableVehicle: true) {
+            edges { cursor node { id vehicle { make } } }
+            pageInfo { hasNextPage }
+        }
+    }
+'''
+
+
+@pytest.mark.django_db
+def test_async_graphql_view_matches_sync_view_with_batched_loaders(client):
+    _jobs_with_vehicles(6)
+    _job_in(2023, 1, 100, 40)
+    sync_response = _post_graphql(client, {'query': ASYNC_DASHBOARD_QUERY})
+    assert 'errors' not in sync_response
+
+    # Both views share the response cache
+    cache.clear()
+    with count_queries() as counter:
+        response = client.post('/graphql/async/', json.dumps({'query': ASYNC_DASHBOARD_QUERY}), content_type='application/json').json()
+    assert response == sync_response
+    # One query per root field plus the page count, and every vehicle's deliveryJobs load in a single batch
+    assert counter.count == 7
+
+
+@pytest.mark.django_db
+def test_async_graphql_view_resolves_root_fields_concurrently(client, monkeypatch):
+    monthly_started = asyncio.Event()
+
+    async def count_after_monthly(**kwargs):
+        # Deadlocks (and times out) unless the monthly resolver runs while this one is waiting
+        await asyncio.wait_for(monthly_started.wait(), 5)
+        return 7
+
+    async def monthly_totals(year, month):
+        monthly_started.set()
+        return MonthlyFinancials(year=year, month=month)
+
+    monkeypatch.setattr('Logistics.schema.acount_delivery_jobs', count_after_monthly)
+    monkeypatch.setattr('Logistics.rollups.amonthly_totals', monthly_totals)
+    query = '{ totalCount calculateMonthlyIncomeCosts(month: 2, year: 2023) { month jobCount } }'
+    response = client.post('/graphql/async/', json.dumps({'query': query}), content_type='application/json').json()
+    assert response == {'data': {'totalCount': 7, 'calculateMonthlyIncomeCosts': {'month': 2, 'jobCount': 0}}}
+
+
+@pytest.mark.django_db
+def test_async_graphql_view_runs_mutations_on_the_sync_path(client):
+    mutation = 'mutation { createVehicle(make: "Volvo", model: "FH", year: 2021) { vehicle { make deliveryJobs { id } } } }'
+    response = client.post('/graphql/async/', json.dumps({'query': mutation}), content_type='application/json').json()
+    assert response == {'data': {'createVehicle': {'vehicle': {'make': 'Volvo', 'deliveryJobs': []}}}}
+    assert Vehicle.objects.filter(make='Volvo').exists()
+
+    body = client.get('/metrics/').content.decode()
+    assert 'logistics_graphql_duration_seconds_count{kind="resolver",name="Mutation.createVehicle"}' in body
+
+
+@pytest.mark.django_db
+def test_read_queries_are_cached_until_a_mutation_writes_their_models(client):
+    vehicles_query = {'query': '{ allVehicles { make } }'}
+    jobs_query = {'query': '{ allDeliveryJobs { destinationLocation } }'}
+    vehicle = Vehicle.objects.create(make='Make', model='Model', year=2022)
+    assert _post_graphql(client, vehicles_query)['data'] == {'allVehicles': [{'make': 'Make'}]}
+    assert _post_graphql(client, jobs_query)['data'] == {'allDeliveryJobs': []}
+
+    # Formatting differences normalize to the same entry
+    Vehicle.objects.create(make='Unseen', model='Model', year=2022)
+    with count_queries() as counter:
+        response = _post_graphql(client, {'query': 'query {\n  allVehicles {\n    make\n  }\n}'})
+    assert response['data'] == {'allVehicles': [{'make': 'Make'}]}
+    assert counter.count == 0
+
+    # Entries are per auth subject
+    token = generate_jwt_token(42)
+    token = token.decode() if isinstance(token, bytes) else token
+    response = client.post('/graphql/', json.dumps(vehicles_query), content_type='application/json', HTTP_AUTHORIZATION=f'Bearer {token}').json()
+    assert len(response['data']['allVehicles']) == 2
+
+    # A vehicle mutation refreshes vehicle listings but leaves the delivery job entry alone
+    _post_graphql(client, {'query': 'mutation { createVehicle(make: "Volvo", model: "FH", year: 2021) { vehicle { id } } }'})
+    assert len(_post_graphql(client, vehicles_query)['data']['allVehicles']) == 3
+    DeliveryJob.objects.create(destination_location='Depot', income=10, costs=1, vehicle=vehicle)
+    assert _post_graphql(client, jobs_query)['data'] == {'allDeliveryJobs': []}
+
+    mutation = 'mutation($id: ID!) { createDeliveryJob(destinationLocation: "Port", deliverySlot: "2023-01-05T10:00:00+00:00", income: 5, costs: 1, vehicleId: $id) { deliveryJob { id } } }'
+    _post_graphql(client, {'query': mutation, 'variables': {'id': vehicle.id}})
+    response = _post_graphql(client, jobs_query)
+    assert response['data'] == {'allDeliveryJobs': [{'destinationLocation': 'Depot'}, {'destinationLocation': 'Port'}]}
+
+
+class GuardedQuery(graphene.ObjectType):
+    me = graphene.Int()
+    again = graphene.Int()
+
+    @jwt_auth_required
+    def resolve_me(root, info):
+        return info.context.user_id
+
+    @jwt_auth_required
+    def resolve_again(root, info):
+        return info.context.user_id
+
+
+def _bearer(token):
+    return 'Bearer ' + (token.decode() if isinstance(token, bytes) else token)
+
+
+def test_jwt_is_verified_once_per_request_and_cached_until_exp(monkeypatch):
+    token_cache.clear()
+    guarded = graphene.Schema(query=GuardedQuery)
+    decode = jwt.decode
+    calls = []
+    monkeypatch.setattr('Logistics.auth.jwt.decode', lambda *args, **kwargs: calls.append(1) or decode(*args, **kwargs))
+    token = _bearer(generate_jwt_token(42))
+
+    result = guarded.execute('{ me again }', context_value=RequestFactory().post('/graphql/', HTTP_AUTHORIZATION=token))
+    assert result.data == {'me': 42, 'again': 42}
+    assert len(calls) == 1
+    # A later request with the same token skips signature verification
+    result = guarded.execute('{ me }', context_value=RequestFactory().post('/graphql/', HTTP_AUTHORIZATION=token))
+    assert result.data == {'me': 42}
+    assert len(calls) == 1
+
+    result = guarded.execute('{ me }', context_value=RequestFactory().post('/graphql/'))
+    assert result.errors[0].message == 'Token is missing'
+    assert result.errors[0].extensions == {'code': 'UNAUTHENTICATED'}
+    expired = jwt.encode(
+        {'user_id': 42, 'exp': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)},
+        settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM,
+    )
+    result = guarded.execute('{ me }', context_value=RequestFactory().post('/graphql/', HTTP_AUTHORIZATION=_bearer(expired)))
+    assert result.errors[0].message == 'Invalid or expired token'
+
+    token_cache.set('stale', 42, time.time() - 1)
+    assert token_cache.get('stale') is None
+
+
+@pytest.mark.django_db
+def test_benchmark_suite_measures_each_scenario_and_flags_regressions():
+    benchmark.seed(jobs=50, vehicles=5)
+    assert DeliveryJob.objects.count() == 50
+    assert MonthlyFinancials.objects.filter(vehicle__isnull=True).exists()
+
+    results = benchmark.run_inprocess(benchmark.Fixture(), iterations=3, warmup=1)
+    assert set(results) == {name for name, _, _ in benchmark.SCENARIOS}
+    assert results['Query.totalCount']['queries'] == 1
+    # Keyset page plus one batched query for the nested lists
+    assert results['Query.allVehiclesConnection']['queries'] == 2
+    assert all(summary['iterations'] == 3 and summary['p50_ms'] <= summary['p99_ms'] for summary in results.values())
+
+    report = {'results': {'inprocess': results}}
+    assert benchmark.compare(report, report) == []
+    slower = json.loads(json.dumps(report))
+    slower['results']['inprocess']['Query.totalCount'].update(p99_ms=results['Query.totalCount']['p99_ms'] * 2, queries=2)
+    regressions = benchmark.compare(slower, report)
+    assert any('Query.totalCount: p99_ms' in line for line in regressions)
+    assert 'inprocess Query.totalCount: SQL queries 1 -> 2' in regressions
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('size', [3, 30])
+def test_graphql_operations_stay_within_query_budgets(graphql_query_budget, size):
+    _jobs_with_vehicles(size)
+    for _ in range(size):
+        _job_in(2023, 3, 100, 30)
+
+    graphql_query_budget('{ calculateMonthlyIncomeCosts(month: 3, year: 2023) { totalIncome jobCount } }', 1)
+    graphql_query_budget('{ calculateYearlyIncomeCosts(year: 2023) { month totalIncome } }', 1)
+    graphql_query_budget('{ totalCount }', 1)
+    # Lists cost a fixed number of statements however many rows (and nested rows) they return
+    data = graphql_query_budget('{ allVehicles { id deliveryJobs { id vehicle { id } } } }', 2)
+    assert len(data['allVehicles']) == size
+    graphql_query_budget('{ allDeliveryJobs(page: 1, pageSize: 50) { id vehicle { make } } }', 2)
+    graphql_query_budget('{ allDeliveryJobsConnection(first: 50) { edges { node { id vehicle { make } } } } }', 1)
+
+    # Completing jobs costs the same for 3 or 30 of them: one locking read and one UPDATE per chunk,
+    # and every job here falls in one rollup bucket
+    job_ids = list(DeliveryJob.objects.filter(vehicle__isnull=True).values_list('id', flat=True))
+    data = graphql_query_budget(
+        'mutation($ids: [Int]!) { markDeliveryJobsAsCompleted(jobIds: $ids) { success } }', 3, {'ids': job_ids}
+    )
+    assert data['markDeliveryJobsAsCompleted']['success']
+    # One INSERT per batch plus the vehicle lookup and the rollup write
+    graphql_query_budget(
+        'mutation($jobs: [DeliveryJobInput!]!) { bulkCreateDeliveryJobs(deliveryJobs: $jobs) { deliveryJobs { id } } }',
+        lambda data: 3 + len(data['bulkCreateDeliveryJobs']['deliveryJobs']) // 500,
+        {'jobs': [{'destinationLocation': 'Depot', 'deliverySlot': '2023-03-02T10:00:00+00:00', 'income': '10', 'costs': '2'}] * size},
+    )
+
+
+@pytest.mark.django_db
+def test_all_vehicles_filters_in_sql_and_pages_by_cursor(graphql_client):
+    for i in range(6):
+        Vehicle.objects.create(make='Volvo' if i % 2 else 'DAF', model='FH' if i < 4 else 'FM', year=2020 + i % 3, is_active=i != 5)
+    Vehicle.objects.create(make='Scania', model='R', year=2021)
+
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute('{ allVehicles(make: "Volvo", isActive: true) { make model year isActive } }')
+    assert response['data']['allVehicles'] == [
+        {'make': 'Volvo', 'model': 'FH', 'year': 2021, 'isActive': True},
+        {'make': 'Volvo', 'model': 'FH', 'year': 2020, 'isActive': True},
+    ]
+    assert '"make" = ' in counter.queries[0] and '"is_active"' in counter.queries[0]
+    response = graphql_client.execute('{ allVehicles(make: "DAF", model: "FH", year: 2022, page: 1, pageSize: 5) { id } }')
+    assert len(response['data']['allVehicles']) == 1
+
+    query = '''
+        query($after: String) {
+            allVehiclesConnection(first: 2, after: $after, isActive: true) {
+                edges { node { id make } }
+                pageInfo { hasNextPage endCursor }
+            }
+        }
+    '''
+    ids, after = [], None
+    while True:
+        connection = graphql_client.execute(query, variables={'after': after})['data']['allVehiclesConnection']
+        ids.extend(int(edge['node']['id']) for edge in connection['edges'])
+        if not connection['pageInfo']['hasNextPage']:
+            break
+        after = connection['pageInfo']['endCursor']
+    assert ids == list(Vehicle.objects.filter(is_active=True).order_by('id').values_list('id', flat=True))
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize('arguments, index', [
+    ({'make': 'Volvo'}, 'vehicle_make_model_year_idx'),
+    ({'make': 'Volvo', 'model': 'FH', 'year': 2021}, 'vehicle_make_model_year_idx'),
+    ({'is_active': True, 'make': 'Volvo', 'model': 'FH'}, 'vehicle_active_mmy_idx'),
+])
+def test_filter_vehicles_uses_fleet_indexes(arguments, index):
+    sql, params = filter_vehicles(**arguments).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        detail = ' '.join(row[-1] for row in cursor.fetchall())
+    assert 'SCAN Logistics_vehicle' not in detail, detail
+    assert index in detail, detail
+    assert plan(vehicle_lookups(**arguments), VEHICLE_INDEXES)[0] == index
+
+
+def _slot(hour, minute=0):
+    return datetime.datetime(2025, 6, 2, hour, minute, tzinfo=datetime.timezone.utc)
+
+
+@pytest.mark.django_db
+def test_bookings_reject_overlapping_slots(graphql_client):
+    vehicle = Vehicle.objects.create(make='Volvo', model='FH', year=2022)
+    booked = DeliveryJob.objects.create(destination_location='Depot', delivery_slot=_slot(10), income=10, costs=1, vehicle=vehicle)
+    assert booked.slot_end == _slot(11)
+    create = '''
+        mutation($slot: DateTime!, $end: DateTime, $vehicleId: ID!) {
+            createDeliveryJob(destinationLocation: "Port", deliverySlot: $slot, slotEnd: $end, income: "5", costs: "1", vehicleId: $vehicleId) {
+                deliveryJob { id slotEnd }
+            }
+        }
+    '''
+
+    response = graphql_client.execute(create, variables={'slot': _slot(10, 30).isoformat(), 'vehicleId': vehicle.id})
+    assert response['errors'][0]['extensions'] == {'code': 'SLOT_CONFLICT', 'conflictingJobIds': [booked.id]}
+    assert DeliveryJob.objects.count() == 1
+    # Back-to-back slots do not overlap
+    response = graphql_client.execute(create, variables={'slot': _slot(11).isoformat(), 'end': _slot(13).isoformat(), 'vehicleId': vehicle.id})
+    assert response['data']['createDeliveryJob']['deliveryJob']['slotEnd'] == _slot(13).isoformat()
+    response = graphql_client.execute(create, variables={'slot': _slot(14).isoformat(), 'end': _slot(14).isoformat(), 'vehicleId': vehicle.id})
+    assert response['errors'][0]['extensions']['code'] == 'INVALID_SLOT'
+
+    other = Vehicle.objects.create(make='DAF', model='XF', year=2021)
+    job = DeliveryJob.objects.create(destination_location='Mall', delivery_slot=_slot(12), income=10, costs=1, vehicle=other)
+    assign = 'mutation($jobId: ID!, $vehicleId: ID!) { assignVehicleToJob(jobId: $jobId, vehicleId: $vehicleId) { deliveryJob { id } } }'
+    response = graphql_client.execute(assign, variables={'jobId': job.id, 'vehicleId': vehicle.id})
+    assert response['errors'][0]['extensions']['conflictingJobIds'] == [booked.id + 1]
+    job.refresh_from_db()
+    assert job.vehicle_id == other.id
+    # Reassigning a job to its own vehicle does not conflict with itself
+    assert 'errors' not in graphql_client.execute(assign, variables={'jobId': job.id, 'vehicleId': other.id})
+
+
+@pytest.mark.django_db
+def test_vehicle_availability_is_one_anti_join(graphql_client):
+    busy = Vehicle.objects.create(make='Volvo', model='FH', year=2022)
+    free = Vehicle.objects.create(make='Volvo', model='FM', year=2022)
+    Vehicle.objects.create(make='Volvo', model='FE', year=2022, is_active=False)
+    DeliveryJob.objects.create(destination_location='Depot', delivery_slot=_slot(9), slot_end=_slot(11), income=10, costs=1, vehicle=busy)
+    DeliveryJob.objects.create(destination_location='Depot', delivery_slot=_slot(12), income=10, costs=1, vehicle=free)
+
+    query = 'query($from: DateTime!, $to: DateTime!) { vehicleAvailability(from: $from, to: $to, make: "Volvo") { model } }'
+    with count_queries() as counter:
+        response = graphql_client.execute(query, variables={'from': _slot(10, 30).isoformat(), 'to': _slot(12).isoformat()})
+    assert response['data']['vehicleAvailability'] == [{'model': 'FM'}]
+    assert counter.count == 1
+    response = graphql_client.execute(query, variables={'from': _slot(11).isoformat(), 'to': _slot(12, 30).isoformat()})
+    assert response['data']['vehicleAvailability'] == [{'model': 'FH'}]
+
+    sql, params = scheduling.conflicting_jobs(busy.id, _slot(10), _slot(11)).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        detail = ' '.join(row[-1] for row in cursor.fetchall())
+    assert 'deliveryjob_vehicle_slot_idx' in detail and 'delivery_slot>? AND delivery_slot<?' in detail, detail
+
+
+def test_dispatch_solver_prefers_profit_and_respects_bookings():
+    jobs = [(1, _slot(10), _slot(11), Decimal(5)), (2, _slot(10), _slot(11), Decimal(50)), (3, _slot(10, 30), _slot(12), Decimal(20)), (4, _slot(12), _slot(13), Decimal(1))]
+    # Vehicle 7 is booked 10:30-11:30, so only vehicle 8 can run a 10:00 slot
+    assignments = dispatch.solve(jobs, [7, 8], {7: [(_slot(10, 30), _slot(11, 30))]})
+    assert assignments[2] == 8
+    assert 1 not in assignments and 3 not in assignments
+    assert assignments[4] in (7, 8)
+
+
+@pytest.mark.django_db
+def test_auto_dispatch_assigns_window_in_one_bulk_update(graphql_client):
+    booked = Vehicle.objects.create(make='Volvo', model='FH', year=2022)
+    free = Vehicle.objects.create(make='DAF', model='XF', year=2022)
+    Vehicle.objects.create(make='MAN', model='TGX', year=2022, is_active=False)
+    DeliveryJob.objects.create(destination_location='Depot', delivery_slot=_slot(10, 30), slot_end=_slot(11, 30), income=10, costs=1, vehicle=booked)
+    cheap = DeliveryJob.objects.create(destination_location='Port', delivery_slot=_slot(10), income=10, costs=5)
+    rich = DeliveryJob.objects.create(destination_location='Port', delivery_slot=_slot(10), income=100, costs=50)
+    late = DeliveryJob.objects.create(destination_location='Mall', delivery_slot=_slot(12), income=30, costs=10)
+    DeliveryJob.objects.create(destination_location='Mall', delivery_slot=_slot(23) + datetime.timedelta(hours=2), income=30, costs=10)
+    DeliveryJob.objects.create(destination_location='Mall', delivery_slot=_slot(12), income=30, costs=10, completed_at=_slot(13))
+    rollups.rebuild()
+
+    mutation = '''
+        mutation($from: DateTime!, $to: DateTime!) {
+            autoDispatch(from: $from, to: $to) { assignedCount totalProfit unassignedJobIds assignments { jobId vehicleId } }
+        }
+    '''
+    variables = {'from': _slot(0).isoformat(), 'to': _slot(23).isoformat()}
+    with count_queries(capture=True) as counter:
+        result = graphql_client.execute(mutation, variables=variables)['data']['autoDispatch']
+    assert result['assignedCount'] == 2
+    assert result['totalProfit'] == '70.00'
+    assert result['unassignedJobIds'] == [str(cheap.id)]
+    assert {item['jobId']: item['vehicleId'] for item in result['assignments']}[str(rich.id)] == str(free.id)
+    assert sum(query.startswith('UPDATE "Logistics_deliveryjob"') for query in counter.queries) == 1
+    late.refresh_from_db()
+    assert late.vehicle_id in (booked.id, free.id)
+
+    incremental = _rollup_snapshot()
+    rollups.rebuild()
+    assert incremental == _rollup_snapshot()
+
+    out = io.StringIO()
+    call_command('auto_dispatch', '--from', _slot(0).isoformat(), '--to', _slot(23).isoformat(), stdout=out)
+    assert 'Assigned 0 jobs' in out.getvalue() and '1 left unassigned' in out.getvalue()
+
+
+@pytest.mark.django_db
+def test_batch_sizes_below_one_are_rejected(graphql_client, tmp_path):
+    mutations = [
+        'mutation($b: Int) { bulkCreateVehicles(vehicles: [{make: "M", model: "M", year: 2022}], batchSize: $b) { errors { index } } }',
+        'mutation($b: Int) { bulkCreateDeliveryJobs(deliveryJobs: [], batchSize: $b) { errors { index } } }',
+        'mutation($b: Int) { autoDispatch(from: "2025-06-02T00:00:00+00:00", to: "2025-06-03T00:00:00+00:00", batchSize: $b) { assignedCount } }',
+    ]
+    for mutation in mutations:
+        for batch_size in (0, -1):
+            response = graphql_client.execute(mutation, variables={'b': batch_size})
+            assert response['errors'][0]['message'] == '`batchSize` must be at least 1.'
+    assert not Vehicle.objects.exists()
+
+    path = tmp_path / 'jobs.ndjson'
+    path.write_text('')
+    with pytest.raises(CommandError, match='--batch-size must be at least 1'):
+        call_command('import_delivery_jobs', str(path), batch_size=0, stdout=io.StringIO(), stderr=io.StringIO())
+    with pytest.raises(CommandError, match='--batch-size must be at least 1'):
+        call_command('auto_dispatch', '--from', '2025-06-02T00:00:00Z', '--to', '2025-06-03T00:00:00Z', '--batch-size', '-1', stdout=io.StringIO())
+
+
+@pytest.mark.django_db
+def test_vehicle_profitability_ranks_vehicles_in_sql(graphql_client):
+    vehicles = [Vehicle.objects.create(make=f'Make {i}', model='Model', year=2022) for i in range(3)]
+    for vehicle, income in [(vehicles[0], 100), (vehicles[0], 50), (vehicles[1], 300), (vehicles[2], 20)]:
+        _job_in(2025, 3, income, 10, vehicle)
+    _job_in(2025, 5, 500, 10, vehicles[2])
+    _job_in(2025, 3, 999, 10)
+
+    query = '''
+        query($from: DateTime, $to: DateTime) {
+            vehicleProfitability(from: $from, to: $to, top: 2) { vehicle { make } totalIncome totalCosts totalProfit jobCount }
+        }
+    '''
+    with count_queries(capture=True) as counter:
+        response = graphql_client.execute(
+            query, variables={'from': '2025-03-01T00:00:00+00:00', 'to': '2025-04-01T00:00:00+00:00'},
+            context_value=RequestFactory().post('/graphql/'),
+        )
+    assert response['data']['vehicleProfitability'] == [
+        {'vehicle': {'make': 'Make 1'}, 'totalIncome': 300.0, 'totalCosts': 10.0, 'totalProfit': 290.0, 'jobCount': 1},
+        {'vehicle': {'make': 'Make 0'}, 'totalIncome': 150.0, 'totalCosts': 20.0, 'totalProfit': 130.0, 'jobCount': 2},
+    ]
+    assert counter.count == 2
+    assert 'GROUP BY "Logistics_deliveryjob"."vehicle_id"' in counter.queries[0] and 'LIMIT 2' in counter.queries[0]
+
+    # All-time totals come from the rollup and match the job table
+    with count_queries(capture=True) as counter:
+        rolled_up = graphql_client.execute(query)['data']['vehicleProfitability']
+    assert 'Logistics_monthlyfinancials' in counter.queries[0]
+    everything = {'from': '2000-01-01T00:00:00+00:00', 'to': '2100-01-01T00:00:00+00:00'}
+    assert rolled_up == graphql_client.execute(query, variables=everything)['data']['vehicleProfitability']
+    assert [row['vehicle']['make'] for row in rolled_up] == ['Make 2', 'Make 1']
+
+    for top in (0, -1):
+        response = graphql_client.execute('query($top: Int) { vehicleProfitability(top: $top) { totalProfit } }', variables={'top': top})
+        assert response['errors'][0]['message'] == '`top` must be at least 1.'
+
+
+@pytest.mark.django_db
+def test_mark_delivery_jobs_as_completed_chunks_and_reports_ids(graphql_client, settings):
+    settings.LOGISTICS_BULK_BATCH_SIZE = 4
+    jobs = [_job_in(2025, 3, 100, 10) for _ in range(6)]
+    done = jobs[0]
+    DeliveryJob.objects.filter(pk=done.pk).update(completed_at=_slot(8))
+    rollups.rebuild()
+
+    mutation = '''
+        mutation($ids: [Int]!, $at: DateTime) {
+            markDeliveryJobsAsCompleted(jobIds: $ids, completedAt: $at) { success msg updatedIds alreadyCompletedIds missingIds }
+        }
+    '''
+    ids = [job.id for job in jobs] + [jobs[1].id, 999999]
+    with count_queries(capture=True) as counter:
+        result = graphql_client.execute(mutation, variables={'ids': ids, 'at': _slot(18).isoformat()})['data']['markDeliveryJobsAsCompleted']
+    assert result['success'] is True
+    assert result['updatedIds'] == [job.id for job in jobs[1:]]
+    assert result['alreadyCompletedIds'] == [done.id]
+    assert result['missingIds'] == [999999]
+    # Two chunks of four ids: a locking read and an UPDATE each
+    assert sum(query.startswith('UPDATE "Logistics_deliveryjob"') for query in counter.queries) == 2
+    assert set(DeliveryJob.objects.exclude(pk=done.pk).values_list('completed_at', flat=True)) == {_slot(18)}
+    done.refresh_from_db()
+    assert done.completed_at == _slot(8)
+
+    incremental = _rollup_snapshot()
+    rollups.rebuild()
+    assert incremental == _rollup_snapshot()
+
+    result = graphql_client.execute(mutation, variables={'ids': [999998]})['data']['markDeliveryJobsAsCompleted']
+    assert result == {'success': False, 'msg': '[999998] does not exist', 'updatedIds': [], 'alreadyCompletedIds': [], 'missingIds': [999998]}
+
+
+@pytest.mark.django_db
+def test_nested_vehicles_are_not_served_from_narrowed_instances(graphql_client, client):
+    _jobs_with_vehicles(10)
+    query = '{ allVehicles { deliveryJobs { vehicle { model year } } } }'
+    with count_queries() as counter:
+        response = graphql_client.execute(query, context_value=RequestFactory().post('/graphql/'))
+    assert response['data']['allVehicles'][0]['deliveryJobs'] == [{'vehicle': {'model': 'Model 0', 'year': 2022}}]
+    assert counter.count == 3
+
+    paged = '{ allVehicles(page: 1, pageSize: 4) { deliveryJobs { vehicle { model year } } } }'
+    response = client.post('/graphql/async/', json.dumps({'query': paged}), content_type='application/json').json()
+    assert 'errors' not in response, response
+    assert response['data']['allVehicles'][3]['deliveryJobs'] == [{'vehicle': {'model': 'Model 3', 'year': 2022}}]
+
+
+def test_histogram_sink_folds_names_past_the_series_cap():
+    sink = HistogramSink(max_series=2)
+    for name in ('A', 'B', 'C', 'D', 'A'):
+        sink.record('operation', name, 0.01, 1, 0.001)
+    sink.record('resolver', 'Query.totalCount', 0.01, 1, 0.001)
+    body = sink.render()
+    assert 'logistics_graphql_duration_seconds_count{kind="operation",name="A"} 2' in body
+    assert 'logistics_graphql_duration_seconds_count{kind="operation",name="other"} 2' in body
+    assert 'name="C"' not in body and 'name="D"' not in body
+    assert 'logistics_graphql_duration_seconds_count{kind="resolver",name="Query.totalCount"} 1' in body